@@ -0,0 +1,36 @@
+"""Micro-benchmark of reverse geocoding query parsing.
+
+Compares parsing query lines one at a time with coords_from_query to
+parsing them in blocks with iter_coords.
+
+  $ python benchmarks/coords.py
+"""
+
+import random
+import timeit
+
+from mapboxcli.scripts.geocoding import coords_from_query, iter_coords
+
+
+def make_lines(count, seed=0):
+    rnd = random.Random(seed)
+    formats = ['{0},{1}', '{0} {1}', '[{0}, {1}]']
+    return [rnd.choice(formats).format(
+                round(rnd.uniform(-180, 180), 6),
+                round(rnd.uniform(-90, 90), 6))
+            for i in range(count)]
+
+
+def main(count=200000, repeat=5):
+    lines = make_lines(count)
+    assert list(map(coords_from_query, lines)) == list(iter_coords(lines))
+    print("{0:<20} {1:>14}".format("parser", "lines/second"))
+    for name, func in [
+            ('coords_from_query', lambda: list(map(coords_from_query, lines))),
+            ('iter_coords', lambda: list(iter_coords(lines)))]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print("{0:<20} {1:>14,.0f}".format(name, count / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Micro-benchmark of polyline decoding.
+
+Compares the polyline package used by the SDK with the decoder in
+mapboxcli.geometry, in pure Python and, if NumPy is installed, with
+NumPy, on a long synthetic route.
+
+  $ python benchmarks/polylines.py
+"""
+
+import timeit
+
+import polyline
+
+from mapboxcli import geometry
+
+
+def make_route(count):
+    return [[-77.0 + i * 1e-4, 38.9 + (i % 50) * 1e-5] for i in range(count)]
+
+
+def main(count=100000, repeat=5):
+    encoded = geometry.encode_polyline(make_route(count), 6)
+    numpy = geometry._import_numpy()
+    decoders = [
+        ('polyline', None, lambda: polyline.decode(encoded, 6)),
+        ('geometry (python)', None,
+         lambda: geometry.decode_polyline(encoded, 6))]
+    if numpy is not None:
+        decoders.append(
+            ('geometry (numpy)', numpy,
+             lambda: geometry.decode_polyline(encoded, 6)))
+
+    print("{0:<20} {1:>16}".format("decoder", "positions/second"))
+    try:
+        for name, module, func in decoders:
+            geometry.numpy = module
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print("{0:<20} {1:>16,.0f}".format(name, count / best))
+    finally:
+        geometry.numpy = numpy
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Cold start benchmark for the mapbox command.
+
+Each command is run in a fresh interpreter several times and the best
+wall time is reported, along with the number of modules imported.
+
+  $ python benchmarks/startup.py
+"""
+
+import subprocess
+import sys
+import timeit
+
+
+COMMANDS = [
+    ['--version'],
+    ['config'],
+    ['--help'],
+    ['geocoding', '--help'],
+    ['directions', '--help'],
+    ['mapmatching', '--help']]
+
+MODULE_COUNT = (
+    "import sys\n"
+    "from click.testing import CliRunner\n"
+    "from mapboxcli.scripts.cli import main_group\n"
+    "CliRunner().invoke(main_group, {0!r})\n"
+    "print(len(sys.modules))\n")
+
+
+def run(args):
+    subprocess.check_call(
+        [sys.executable, '-m', 'mapboxcli'] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def main(repeat=10):
+    baseline = min(timeit.repeat(
+        lambda: subprocess.check_call([sys.executable, '-c', 'pass']),
+        number=1, repeat=repeat))
+    print("{0:<24} {1:>10} {2:>10}".format("command", "best (ms)", "modules"))
+    print("{0:<24} {1:>10.1f} {2:>10}".format(
+        "(bare interpreter)", baseline * 1000, "-"))
+    for args in COMMANDS:
+        best = min(timeit.repeat(
+            lambda: run(args), number=1, repeat=repeat))
+        modules = subprocess.check_output(
+            [sys.executable, '-c', MODULE_COUNT.format(args)])
+        print("{0:<24} {1:>10.1f} {2:>10}".format(
+            ' '.join(args), best * 1000, int(modules.strip())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# asyncio request engine.
+#
+# Requires Python 3 and aiohttp, which is installed with the "async"
+# extra: pip install mapboxcli[async].
+
+import asyncio
+from collections import OrderedDict
+import threading
+
+import aiohttp
+
+from mapboxcli.batch import Response
+
+
+# Errors of requests that fail to connect or time out.
+CLIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class _RecordedResponse(object):
+    """Returned to a service in place of a response. Services set
+    attributes like geojson on their responses."""
+
+    status_code = 200
+
+
+class RequestRecorder(object):
+    """Stands in for a service's requests session and records the
+    request that the service makes instead of sending it."""
+
+    def __init__(self, session):
+        self.params = session.params
+        self.headers = session.headers
+        self.request = None
+
+    def get(self, url, params=None, **kwargs):
+        merged = dict(self.params)
+        merged.update(params or {})
+        self.request = (url, merged)
+        return _RecordedResponse()
+
+
+def record_request(service, call):
+    """Return the URL and query parameters of the GET request made by
+    calling call, which uses the SDK service.
+
+    The SDK's validation of parameters happens as usual, but no
+    request is sent. Not thread safe: the service's session is
+    replaced during the call.
+    """
+    session = service.session
+    recorder = service.session = RequestRecorder(session)
+    try:
+        call()
+    finally:
+        service.session = session
+    return recorder.request
+
+
+def paired(func):
+    """Wrap a coroutine function of an item so that it returns the item
+    and its result, which can then be matched when results are
+    unordered."""
+    async def wrapper(item):
+        return item, await func(item)
+    return wrapper
+
+
+class AsyncEngine(object):
+    """Makes HTTP requests on an asyncio event loop.
+
+    The loop runs in one background thread, however many requests are
+    in flight. Requests share a pool of at most `concurrency`
+    connections. Use as a context manager and pass as the executor of
+    mapboxcli.batch.imap.
+
+    If a mapboxcli.batch.AdaptiveLimit is given, requests are made
+    within it and rate limited requests are retried.
+    """
+
+    def __init__(self, concurrency=1, headers=None, limit=None):
+        self.concurrency = concurrency
+        self.headers = dict(headers or {})
+        self.limit = limit
+        self.loop = None
+        self._thread = None
+        self._session = None
+        self._semaphore = None
+        self._released = None
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _open(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._released = asyncio.Event()
+        self._session = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(limit=self.concurrency))
+
+    async def _close(self):
+        await self._session.close()
+
+    def submit(self, func, item):
+        """Schedule the coroutine func(item) on the loop.
+
+        Returns a concurrent.futures Future.
+        """
+        return asyncio.run_coroutine_threadsafe(func(item), self.loop)
+
+    async def get(self, url, params=None):
+        """Make a GET request and return a response."""
+        # aiohttp accepts only strings as query parameter values.
+        params = dict((k, str(v)) for k, v in (params or {}).items()
+                      if v is not None)
+        if self.limit is None:
+            async with self._semaphore:
+                return await self._get(url, params)
+
+        for attempt in range(self.limit.retries + 1):
+            token = await self._acquire()
+            try:
+                resp = await self._get(url, params)
+            except BaseException:
+                self._release(token)
+                raise
+            if not self._release(token, resp):
+                break
+        return resp
+
+    async def _get(self, url, params):
+        async with self._session.get(url, params=params) as resp:
+            content = await resp.read()
+            return Response(resp.status, dict(resp.headers), content)
+
+    async def _acquire(self):
+        while True:
+            # The event is only set on the loop's thread, so a release
+            # can't be missed between trying and waiting.
+            self._released.clear()
+            token, wait = self.limit.try_acquire()
+            if token is not None:
+                return token
+            try:
+                await asyncio.wait_for(self._released.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self, token, resp=None):
+        throttled = self.limit.release(token, resp)
+        self._released.set()
+        return throttled
+
+
+class Fetcher(object):
+    """A coroutine function that fetches the response for an item.
+
+    The request for an item is recorded by `record`, a function of the
+    item that returns a URL and query parameters. Responses are looked
+    up in and saved to a ResponseCache if one is given. Items with the
+    same `coalesce_key` share one request, like batch.Coalescer.
+
+    Items that take more than one request can be fetched with blocking
+    calls: `fallback` is a function of an item that returns a function
+    which gets the item's response, or None. That function is called
+    in a thread of the loop's default executor. Exceptions of the
+    `errors` types are returned as an item's result instead of being
+    raised.
+    """
+
+    def __init__(self, engine, record, cache=None, cache_key=None,
+                 coalesce_key=None, max_size=10000, fallback=None,
+                 errors=()):
+        self.engine = engine
+        self.record = record
+        self.cache = cache
+        self.cache_key = cache_key
+        self.coalesce_key = coalesce_key
+        self.max_size = max_size
+        self.fallback = fallback
+        self.errors = errors
+        self.saved = 0
+        self._memo = OrderedDict()
+
+    async def __call__(self, item):
+        try:
+            return await self._coalesce(item)
+        except self.errors as exc:
+            return exc
+
+    async def _coalesce(self, item):
+        if self.coalesce_key is None:
+            return await self._fetch(item)
+
+        # The memo is only used on the loop's thread and needs no lock.
+        key = self.coalesce_key(item)
+        future = self._memo.pop(key, None)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(item))
+            if len(self._memo) >= self.max_size:
+                self._memo.popitem(last=False)
+        else:
+            self.saved += 1
+        self._memo[key] = future
+        return await asyncio.shield(future)
+
+    async def _fetch(self, item):
+        fetch = self.fallback(item) if self.fallback is not None else None
+        if fetch is not None:
+            return await self.engine.loop.run_in_executor(None, fetch)
+        # Recording validates an item, whether or not its response is
+        # cached.
+        url, params = self.record(item)
+        if self.cache is not None:
+            resp = self.cache.get(self.cache_key(item))
+            if resp is not None:
+                return resp
+        resp = await self.engine.get(url, params)
+        if self.cache is not None:
+            self.cache.set(self.cache_key(item), resp)
+        return resp
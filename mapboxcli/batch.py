@@ -0,0 +1,406 @@
+# Batch request helpers.
+
+from collections import OrderedDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ThreadPoolExecutor, wait)
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Response(object):
+    """A response made from stored content, such as a cache entry or
+    one part of a batch response.
+
+    Has the attributes of a requests Response that mapbox commands
+    use to write output.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def imap(func, iterable, concurrency=1, ordered=True, executor=None):
+    """Apply func to the items of iterable using a pool of threads.
+
+    At most `concurrency` calls are in progress at once and the
+    iterable is consumed lazily, so a stream of unknown length can be
+    processed with bounded memory. Results are yielded in input order
+    unless `ordered` is False, in which case they are yielded as soon
+    as they are ready. Exceptions raised by func are raised when the
+    corresponding result is yielded.
+
+    An executor other than a thread pool, such as mapboxcli.aio's
+    AsyncEngine, may be given. Its submit method must return a
+    concurrent.futures Future.
+    """
+    if executor is not None:
+        for result in _imap(
+                executor, func, iterable, concurrency, ordered):
+            yield result
+        return
+
+    if concurrency <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for result in _imap(
+                executor, func, iterable, concurrency, ordered):
+            yield result
+
+
+def _imap(executor, func, iterable, concurrency, ordered):
+    # Keep a few more calls queued than there are workers so that
+    # workers don't wait on the consumer.
+    window = 2 * concurrency
+
+    if ordered:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+    else:
+        pending = set()
+        try:
+            for item in iterable:
+                pending.add(executor.submit(func, item))
+                timeout = None if len(pending) >= window else 0
+                done, pending = wait(
+                    pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class Coalescer(object):
+    """Wraps a function so that it is called once per distinct key.
+
+    Calls with an item whose key has been seen before, including
+    calls that are still in progress in other threads, get the first
+    call's result. The results of the `max_size` most recently used
+    keys are remembered. The number of calls saved is counted.
+    """
+
+    def __init__(self, func, key, max_size=10000):
+        self.func = func
+        self.key = key
+        self.max_size = max_size
+        self.saved = 0
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+
+    def claim(self, key):
+        """Return the future of a key's result and whether the caller
+        owns it, in which case the caller must set its result or
+        exception. Claims of a key that has been seen before are
+        counted as saved."""
+        with self._lock:
+            future = self._memo.pop(key, None)
+            owner = future is None
+            if owner:
+                future = Future()
+                if len(self._memo) >= self.max_size:
+                    self._memo.popitem(last=False)
+            else:
+                self.saved += 1
+            self._memo[key] = future
+        return future, owner
+
+    def __call__(self, item):
+        future, owner = self.claim(self.key(item))
+        if owner:
+            try:
+                future.set_result(self.func(item))
+            except Exception as exc:
+                future.set_exception(exc)
+        return future.result()
+
+
+class Checkpoint(object):
+    """Records the progress of a batch job in a JSON file.
+
+    The file holds the number of input items completed and the size of
+    the output written for them, which is the output's position after
+    the last completed item was written. An item may be partly written
+    past it. The file is replaced atomically, after the output has been
+    synced to disk, every `interval` items.
+
+    A job, a JSON serializable description of the batch job such as
+    its input, output and options, is recorded too, so that a
+    checkpoint isn't resumed by a different job.
+    """
+
+    def __init__(self, path, interval=1000, job=None):
+        self.path = path
+        self.interval = interval
+        self.job = job
+        self._saved = None
+
+    def load(self):
+        """Return the number of completed items and the output offset
+        recorded in the file, or zeros if there is no file.
+
+        Raises ValueError if the file was saved by a different job.
+        """
+        if not os.path.exists(self.path):
+            return 0, 0
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('job') != json.loads(json.dumps(self.job)):
+            raise ValueError(
+                "Checkpoint {0} was saved by a job with a different "
+                "input, output or options".format(self.path))
+        self._saved = state['count']
+        return state['count'], state['offset']
+
+    def save(self, count, output, offset):
+        """Record that count items are completed and written to the
+        first offset bytes of the output file."""
+        output.flush()
+        os.fsync(output.fileno())
+        tmp = '{0}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump({'count': count, 'offset': offset,
+                       'job': self.job}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+        self._saved = count
+
+    def update(self, count, output, offset):
+        """Save if interval items have completed since the last save."""
+        if count - (self._saved or 0) >= self.interval:
+            self.save(count, output, offset)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def chunks(iterable, size):
+    """Yield lists of up to size consecutive items of iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _number(headers, name):
+    """Get the numeric value of a header or None."""
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimit(object):
+    """Adapts the number of concurrent requests to an API's rate limit.
+
+    The limit starts at `maximum`. It is halved when a response has
+    status 429 (Too Many Requests) and raised by one after `limit`
+    consecutive successful responses, up to `maximum`, while the rate
+    limit headers of responses show headroom. After a 429, no requests
+    are started until the rate limit resets (or an exponential backoff
+    passes) plus some jitter, and the request is retried up to
+    `retries` times.
+
+    Thread safe. Requests are made with call, or between try_acquire
+    (or acquire) and release.
+    """
+
+    def __init__(self, maximum, minimum=1, retries=5, backoff=1.0,
+                 max_backoff=60.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.throttled = 0
+        self._successes = 0
+        self._failures = 0
+        self._generation = 0
+        self._resume = 0
+        self._window = None
+        self._random = random.Random()
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        """Start a request if the limit allows.
+
+        Returns a token to pass to release, or None and the number of
+        seconds to wait before trying again. The wait is None if it
+        lasts until another request is released.
+        """
+        with self._cond:
+            wait = self._resume - time.time()
+            if wait > 0:
+                return None, wait
+            if self.in_flight >= self.limit:
+                return None, None
+            self.in_flight += 1
+            return self._generation, None
+
+    def acquire(self):
+        """Wait until a request can be started and return its token."""
+        with self._cond:
+            while True:
+                token, wait = self.try_acquire()
+                if token is not None:
+                    return token
+                self._cond.wait(wait)
+
+    def release(self, token, resp=None):
+        """Finish a request and adapt the limit to its response, if
+        any. Returns True if the response is a 429."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            if resp is None:
+                return False
+            headers = dict((k.lower(), v) for k, v in resp.headers.items())
+            if resp.status_code == 429:
+                self.throttled += 1
+                self._throttle(token, headers)
+                return True
+            self._failures = 0
+            self._successes += 1
+            remaining = self._remaining(headers)
+            if (self._successes >= self.limit and
+                    self.limit < self.maximum and
+                    (remaining is None or remaining > 2 * self.limit)):
+                self._successes = 0
+                self.limit += 1
+                logger.info("Concurrency raised to %d", self.limit)
+            return False
+
+    def call(self, func, *args, **kwargs):
+        """Call func, which makes a request and returns its response,
+        within the limit. Rate limited requests are retried and the
+        last response is returned."""
+        for attempt in range(self.retries + 1):
+            token = self.acquire()
+            try:
+                resp = func(*args, **kwargs)
+            except Exception:
+                self.release(token)
+                raise
+            if not self.release(token, resp):
+                break
+        return resp
+
+    def _throttle(self, token, headers):
+        # Requests that started before the limit was last lowered
+        # belong to the same burst and don't lower it again.
+        if token != self._generation:
+            return
+        self._generation += 1
+        self._failures += 1
+        self._successes = 0
+        previous = self.limit
+        self.limit = max(self.minimum, self.limit // 2)
+
+        now = time.time()
+        delay = _number(headers, 'retry-after')
+        if delay is None:
+            reset = _number(headers, 'x-rate-limit-reset')
+            if reset is not None and reset > now:
+                delay = reset - now
+            else:
+                delay = self.backoff * 2 ** (self._failures - 1)
+        # Jitter spreads out the retries of concurrent requests.
+        delay = min(delay, self.max_backoff) * self._random.uniform(1, 1.5)
+        self._resume = max(self._resume, now + delay)
+        logger.info(
+            "Rate limited: concurrency lowered from %d to %d, pausing "
+            "%.1f seconds", previous, self.limit, delay)
+
+    def _remaining(self, headers):
+        """Estimate the requests remaining in the rate limit window.
+
+        The X-Rate-Limit-Remaining header is used if present.
+        Otherwise, responses with the same X-Rate-Limit-Reset are
+        counted against X-Rate-Limit-Limit. Returns None if the
+        headers are missing.
+        """
+        remaining = _number(headers, 'x-rate-limit-remaining')
+        if remaining is not None:
+            return remaining
+        limit = _number(headers, 'x-rate-limit-limit')
+        reset = headers.get('x-rate-limit-reset')
+        if limit is None or reset is None:
+            return None
+        if self._window is None or self._window[0] != reset:
+            self._window = [reset, 0]
+        self._window[1] += 1
+        return limit - self._window[1]
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """A requests transport adapter that sends requests within an
+    AdaptiveLimit."""
+
+    def __init__(self, limit, **kwargs):
+        self.limit = limit
+        super(ThrottledAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        return self.limit.call(
+            super(ThrottledAdapter, self).send, request, **kwargs)
+
+
+def mount_pool(session, pool_size, limit=None):
+    """Size a requests session's HTTPS connection pool.
+
+    Concurrent requests made through the session share this pool of
+    up to `pool_size` kept-alive connections. If an AdaptiveLimit is
+    given, requests are sent within it.
+    """
+    kwargs = dict(pool_connections=1, pool_maxsize=pool_size)
+    if limit is None:
+        adapter = HTTPAdapter(**kwargs)
+    else:
+        adapter = ThrottledAdapter(limit, **kwargs)
+    session.mount('https://', adapter)
+    return session
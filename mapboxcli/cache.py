@@ -0,0 +1,183 @@
+# Persistent response cache.
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from mapboxcli.batch import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    """A size-bounded, least recently used cache of HTTP responses
+    stored in a SQLite database.
+
+    Only successful responses are stored. Entries older than `ttl`
+    seconds are treated as missing and at most `max_entries` entries
+    are kept. The cache may be shared by threads and by processes:
+    each response is stored in its own short transaction, and if the
+    database stays locked by another process for `busy_timeout`
+    seconds, a lookup is a miss and a response isn't stored.
+    """
+
+    # Access times of hits are recorded, and the cache trimmed, every
+    # this many hits or writes, and on close.
+    sync_interval = 100
+
+    busy_timeout = 5.0
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        dirname = os.path.dirname(path)
+        if dirname:
+            try:
+                os.makedirs(dirname)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._accessed = {}
+        self._lock = threading.Lock()
+        # Statements are committed as they are executed, outside of
+        # explicit transactions.
+        self._conn = sqlite3.connect(
+            path, timeout=self.busy_timeout, isolation_level=None,
+            check_same_thread=False)
+        # Readers don't block a writer, or a writer readers, in
+        # write-ahead log mode.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, created REAL, accessed REAL, "
+            "status INTEGER, headers TEXT, content BLOB)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed "
+            "ON responses (accessed)")
+
+    @staticmethod
+    def key(*parts):
+        """Make a cache key from JSON serializable parts."""
+        text = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key or None."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT created, status, headers, content FROM "
+                    "responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.OperationalError as exc:
+                logger.info("Cache lookup failed: %s", exc)
+                row = None
+            if row is not None and self.ttl is not None and \
+                    now - row[0] > self.ttl:
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = now
+            if len(self._accessed) >= self.sync_interval:
+                self._sync()
+        return Response(row[1], json.loads(row[2]), bytes(row[3]))
+
+    def set(self, key, response):
+        """Store a successful response."""
+        if response.status_code != 200:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, now, now, response.status_code,
+                     json.dumps(dict(response.headers)),
+                     sqlite3.Binary(response.content)))
+            except sqlite3.OperationalError as exc:
+                logger.info("Response not cached: %s", exc)
+                return
+            self._accessed.pop(key, None)
+            self._writes += 1
+            if self._writes % self.sync_interval == 0:
+                self._sync()
+
+    def fetch(self, key, func):
+        """Return the cached response for key, or call func to get
+        and store it."""
+        response = self.get(key)
+        if response is None:
+            response = func()
+            self.set(key, response)
+        return response
+
+    def _sync(self):
+        # Record the access times of hits and trim the cache in one
+        # transaction.
+        accessed, self._accessed = self._accessed, {}
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE responses SET accessed = ? WHERE key = ? "
+                    "AND accessed < ?",
+                    [(t, key, t) for key, t in accessed.items()])
+                if self.ttl is not None:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE created < ?",
+                        (time.time() - self.ttl,))
+                if self.max_entries is not None:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        "SELECT key FROM responses ORDER BY accessed DESC "
+                        "LIMIT -1 OFFSET ?)", (self.max_entries,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        except sqlite3.OperationalError as exc:
+            logger.info("Cache not trimmed: %s", exc)
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._conn.close()
+
+
+def cached(cache, func, key):
+    """Wrap a function that makes a request for an item so that its
+    responses are looked up in and stored to a cache.
+
+    key is a function of the item that returns the item's cache key.
+    """
+    if cache is None:
+        return func
+
+    def wrapper(item):
+        return cache.fetch(key(item), lambda: func(item))
+
+    return wrapper
+
+
+def open_cache(name, cache_dir=None, ttl=None, max_entries=None):
+    """Open the named response cache in cache_dir, by default the
+    mapbox app directory's cache subdirectory."""
+    if cache_dir is None:
+        import click
+        cache_dir = os.path.join(click.get_app_dir('mapbox'), 'cache')
+    return ResponseCache(
+        os.path.join(cache_dir, '{0}.sqlite'.format(name)),
+        ttl=ttl, max_entries=max_entries)
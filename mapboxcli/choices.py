@@ -0,0 +1,29 @@
+# Static choice tables for command options.
+#
+# These mirror attributes of the mapbox SDK's service classes so that
+# command modules can declare their options without constructing
+# services (and their HTTP sessions) at import time. The test suite
+# checks them against the SDK.
+
+GEOCODING_DATASETS = ('mapbox.places', 'mapbox.places-permanent')
+
+GEOCODING_PLACE_TYPES = (
+    'address', 'country', 'district', 'locality', 'neighborhood', 'place',
+    'poi', 'poi.landmark', 'postcode', 'region')
+
+DIRECTIONS_PROFILES = (
+    'mapbox/driving', 'mapbox/driving-traffic', 'mapbox/walking',
+    'mapbox/cycling')
+
+DIRECTIONS_GEOMETRIES = ('geojson', 'polyline', 'polyline6')
+
+# The SDK's overview values include the bool False, which breaks
+# click.Choice's help output. It is represented by the string 'False'
+# here and converted back by the directions command.
+DIRECTIONS_OVERVIEWS = ('full', 'simplified', 'False')
+
+MATRIX_PROFILES = (
+    'mapbox/driving', 'mapbox/driving-traffic', 'mapbox/walking',
+    'mapbox/cycling')
+
+MAPMATCHING_PROFILES = ('mapbox.driving', 'mapbox.cycling', 'mapbox.walking')
@@ -1,6 +1,7 @@
 # compatibility module.
 
 import itertools
+import json
 import sys
 
 from six.moves import configparser
@@ -8,3 +9,20 @@ from six.moves import configparser
 
 map = itertools.imap if sys.version_info < (3,) else map
 
+
+def json_codec(name='json'):
+    """Return the loads and dumps functions of a JSON library.
+
+    The name may be 'json' (the standard library) or 'orjson'. Both
+    functions work with UTF-8 encoded bytes.
+    """
+    if name == 'orjson':
+        # Imported here so that commands which don't use it, and the
+        # CLI's startup, don't pay for it.
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("orjson is not installed")
+        return orjson.loads, orjson.dumps
+    return (lambda b: json.loads(b.decode('utf-8')),
+            lambda obj: json.dumps(obj).encode('utf-8'))
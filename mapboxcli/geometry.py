@@ -0,0 +1,165 @@
+# Route geometry helpers.
+
+import math
+
+
+# Encoded polylines and lines at least this long are processed with
+# NumPy, if it is installed. Shorter ones are faster in pure Python.
+NUMPY_MIN_LENGTH = 256
+
+# The numpy module, None if it isn't installed, or False until a long
+# enough line needs it. Importing it costs more than most commands'
+# startup, so it isn't imported before then.
+numpy = False
+
+
+def _import_numpy():
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def decode_polyline(encoded, precision=5):
+    """Decode an encoded polyline into a list of [lng, lat] positions.
+
+    Positions are in GeoJSON order, the reverse of the encoding's
+    order. Use precision 6 for the Directions API's polyline6.
+    """
+    if len(encoded) >= NUMPY_MIN_LENGTH and _import_numpy() is not None:
+        return _decode_numpy(encoded, precision)
+
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+        else:
+            shift += 5
+
+    factor = 10.0 ** precision
+    coords = []
+    lat = lng = 0
+    for i in range(0, len(values) - 1, 2):
+        lat += values[i]
+        lng += values[i + 1]
+        coords.append([lng / factor, lat / factor])
+    return coords
+
+
+def _decode_numpy(encoded, precision):
+    chunks = numpy.frombuffer(
+        encoded.encode('ascii'), dtype=numpy.uint8).astype(numpy.int64) - 63
+
+    # Each value is a run of 5 bit chunks ending with a chunk below
+    # 0x20. Shift the chunks into place and sum them per value.
+    ends = numpy.flatnonzero(chunks < 0x20)
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    run = numpy.zeros(len(chunks), dtype=numpy.int64)
+    run[starts[1:]] = 1
+    offsets = numpy.arange(len(chunks)) - starts[numpy.cumsum(run)]
+    values = numpy.add.reduceat((chunks & 0x1f) << (5 * offsets), starts)
+    values = numpy.where(values & 1, ~(values >> 1), values >> 1)
+
+    values = values[:len(values) // 2 * 2].reshape(-1, 2)
+    coords = numpy.cumsum(values, axis=0) / 10.0 ** precision
+    return coords[:, ::-1].tolist()
+
+
+def _round(value):
+    # Round half away from zero, like the reference encoder.
+    return int(math.copysign(math.floor(abs(value) + 0.5), value))
+
+
+def encode_polyline(coords, precision=5):
+    """Encode a sequence of [lng, lat] positions as a polyline."""
+    factor = 10 ** precision
+    chars = []
+    prev_lat = prev_lng = 0
+    for position in coords:
+        lat = _round(position[1] * factor)
+        lng = _round(position[0] * factor)
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chars)
+
+
+def _farthest(coords, first, last):
+    # The index and squared distance of the position between first and
+    # last that is farthest from the segment joining them.
+    ax, ay = coords[first][0], coords[first][1]
+    dx, dy = coords[last][0] - ax, coords[last][1] - ay
+    length = dx * dx + dy * dy
+    index, farthest = None, -1.0
+    for i in range(first + 1, last):
+        px, py = coords[i][0] - ax, coords[i][1] - ay
+        if length:
+            t = min(max((px * dx + py * dy) / length, 0.0), 1.0)
+            px, py = px - t * dx, py - t * dy
+        distance = px * px + py * py
+        if distance > farthest:
+            index, farthest = i, distance
+    return index, farthest
+
+
+def _farthest_numpy(points, first, last):
+    a, b = points[first], points[last]
+    d = b - a
+    p = points[first + 1:last] - a
+    length = d.dot(d)
+    if length:
+        t = numpy.clip(p.dot(d) / length, 0.0, 1.0)
+        p = p - t[:, None] * d
+    distances = (p * p).sum(axis=1)
+    i = int(distances.argmax())
+    return first + 1 + i, float(distances[i])
+
+
+def simplify(coords, tolerance):
+    """Simplify a line of [lng, lat] positions with the Douglas-Peucker
+    algorithm.
+
+    Positions farther than tolerance, in coordinate units, from the
+    simplified line are kept, as are the ends of the line.
+    """
+    count = len(coords)
+    if count < 3 or tolerance <= 0:
+        return list(coords)
+
+    if count >= NUMPY_MIN_LENGTH and _import_numpy() is not None:
+        points = numpy.array([c[:2] for c in coords], dtype=float)
+        farthest = lambda first, last: _farthest_numpy(points, first, last)
+    else:
+        farthest = lambda first, last: _farthest(coords, first, last)
+
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    tolerance *= tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        index, distance = farthest(first, last)
+        if distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, k in zip(coords, keep) if k]
+
+
+def round_coordinates(coords, precision):
+    """Round the values of positions to precision decimal places."""
+    return [[round(v, precision) for v in c] for c in coords]
@@ -0,0 +1,249 @@
+# Splitting and stitching of Directions API routes.
+
+from six import string_types
+
+from mapboxcli.geometry import (
+    decode_polyline, encode_polyline, round_coordinates, simplify)
+
+
+# The maximum number of waypoints in one Directions API request.
+MAX_WAYPOINTS = 25
+
+# Polyline precisions of the Directions API's encoded geometries.
+POLYLINE_PRECISION = {'polyline': 5, 'polyline6': 6}
+
+# The columns of segment rows before their annotations, and the types
+# of columns that aren't strings.
+SEGMENT_FIELDS = ('route', 'leg', 'segment', 'start_lng', 'start_lat',
+                  'end_lng', 'end_lat')
+SEGMENT_TYPES = {
+    'index': 'int', 'route': 'int', 'leg': 'int', 'segment': 'int',
+    'start_lng': 'float', 'start_lat': 'float', 'end_lng': 'float',
+    'end_lat': 'float', 'duration': 'float', 'distance': 'float',
+    'speed': 'float', 'congestion_numeric': 'int'}
+
+
+def split_waypoints(count, max_waypoints=MAX_WAYPOINTS):
+    """Split a route of count waypoints into segments.
+
+    Returns a list of (start, stop) slices of at most max_waypoints
+    waypoints. Consecutive segments share one waypoint, the end of
+    one being the start of the next.
+    """
+    segments = []
+    start = 0
+    while True:
+        stop = min(start + max_waypoints, count)
+        segments.append((start, stop))
+        if stop == count:
+            return segments
+        start = stop - 1
+
+
+def join_coordinates(parts):
+    """Join lists of coordinates, dropping the first coordinate of a
+    part if it repeats the last of the previous part."""
+    coords = []
+    for part in parts:
+        if coords and part and list(part[0]) == list(coords[-1]):
+            part = part[1:]
+        coords.extend(part)
+    return coords
+
+
+def stitch_geometries(geometries, geometry_format):
+    """Join the route geometries of consecutive segments."""
+    if geometry_format in POLYLINE_PRECISION:
+        precision = POLYLINE_PRECISION[geometry_format]
+        return encode_polyline(
+            join_coordinates(
+                [decode_polyline(g, precision) for g in geometries]),
+            precision)
+    return {
+        'type': 'LineString',
+        'coordinates': join_coordinates(
+            [g['coordinates'] for g in geometries])}
+
+
+def stitch_routes(responses, geometry_format='geojson'):
+    """Stitch the responses of consecutive route segments into one.
+
+    The first route of each response is used. Legs and waypoints are
+    concatenated, with the shared waypoints of segments appearing once,
+    distances, durations and weights are summed, and geometries are
+    joined.
+    """
+    routes = [data['routes'][0] for data in responses]
+    route = dict(routes[0])
+    route['legs'] = [leg for r in routes for leg in r.get('legs', [])]
+    for key in ('distance', 'duration', 'weight'):
+        if key in route:
+            route[key] = sum(r.get(key, 0) for r in routes)
+    if 'geometry' in route:
+        route['geometry'] = stitch_geometries(
+            [r['geometry'] for r in routes], geometry_format)
+
+    waypoints = list(responses[0].get('waypoints', []))
+    for data in responses[1:]:
+        waypoints.extend(data.get('waypoints', [])[1:])
+
+    result = dict(responses[0])
+    result['routes'] = [route]
+    result['waypoints'] = waypoints
+    return result
+
+
+def _geometry_items(data):
+    # The routes and steps of a response's data, which have geometries.
+    for route in data.get('routes', []):
+        yield route
+        for leg in route.get('legs', []):
+            for step in leg.get('steps', []):
+                yield step
+
+
+def decode_geometries(data, geometry_format):
+    """Replace the polyline geometries of the routes and steps of a
+    response's data with GeoJSON LineStrings."""
+    precision = POLYLINE_PRECISION.get(geometry_format)
+    if precision is None:
+        return data
+
+    for item in _geometry_items(data):
+        if isinstance(item.get('geometry'), string_types):
+            item['geometry'] = {
+                'type': 'LineString',
+                'coordinates': decode_polyline(item['geometry'], precision)}
+    return data
+
+
+def simplify_geometries(data, geometry_format, tolerance=None,
+                        precision=None):
+    """Simplify the geometries of the routes and steps of a response's
+    data, in place.
+
+    Lines are simplified with a tolerance in degrees, then their
+    coordinates are rounded to precision decimal places. Polyline
+    geometries stay encoded.
+    """
+    def shape(coords):
+        if tolerance:
+            coords = simplify(coords, tolerance)
+        if precision is not None:
+            coords = round_coordinates(coords, precision)
+        return coords
+
+    polyline_precision = POLYLINE_PRECISION.get(geometry_format)
+    for item in _geometry_items(data):
+        geometry = item.get('geometry')
+        if isinstance(geometry, string_types):
+            if polyline_precision is not None:
+                item['geometry'] = encode_polyline(
+                    shape(decode_polyline(geometry, polyline_precision)),
+                    polyline_precision)
+        elif isinstance(geometry, dict) and 'coordinates' in geometry:
+            geometry['coordinates'] = shape(geometry['coordinates'])
+    return data
+
+
+def _properties(item, exclude, **indexes):
+    properties = dict(
+        (key, value) for key, value in item.items() if key not in exclude)
+    properties.update(indexes)
+    return properties
+
+
+def iter_features(data, level='route'):
+    """Yield a GeoJSON feature for each route, leg or step of a
+    response's data, with GeoJSON geometries.
+
+    Features have the members of their route, leg or step as
+    properties, other than nested legs, steps and geometries, and
+    "route", "leg" and "step" properties with their indexes. Leg
+    geometries are joined from their steps, or null without steps.
+    """
+    for i, route in enumerate(data.get('routes', [])):
+        if level == 'route':
+            yield {
+                'type': 'Feature',
+                'geometry': route.get('geometry'),
+                'properties': _properties(
+                    route, ('geometry', 'legs'), route=i)}
+            continue
+
+        for j, leg in enumerate(route.get('legs', [])):
+            steps = leg.get('steps') or []
+            if level == 'leg':
+                geometry = None
+                if steps:
+                    geometry = {
+                        'type': 'LineString',
+                        'coordinates': join_coordinates(
+                            [s['geometry']['coordinates'] for s in steps
+                             if s.get('geometry')])}
+                yield {
+                    'type': 'Feature',
+                    'geometry': geometry,
+                    'properties': _properties(
+                        leg, ('steps',), route=i, leg=j)}
+                continue
+
+            for k, step in enumerate(steps):
+                yield {
+                    'type': 'Feature',
+                    'geometry': step.get('geometry'),
+                    'properties': _properties(
+                        step, ('geometry',), route=i, leg=j, step=k)}
+
+
+def _segment_count(annotation):
+    return max([len(v) for v in annotation.values() if isinstance(v, list)] or
+               [0])
+
+
+def segment_fields(annotations, index=False):
+    """Return the columns of the segment rows of routes with the
+    given annotations, with an "index" column first if index is
+    True."""
+    fields = list(SEGMENT_FIELDS) + [
+        name for name in annotations if name not in SEGMENT_FIELDS]
+    if index:
+        fields.insert(0, 'index')
+    return fields
+
+
+def iter_segments(data):
+    """Yield a row for each segment of the legs of the routes of a
+    response's data, which must have GeoJSON geometries.
+
+    Segments are the spans between consecutive coordinates of a route's
+    full geometry, with which the annotations of its legs are aligned.
+    Rows are dicts with "route", "leg" and "segment" indexes, a value
+    of each annotation, and the segment's "start_lng", "start_lat",
+    "end_lng" and "end_lat" if the geometry has a coordinate for each
+    segment.
+    """
+    for i, route in enumerate(data.get('routes', [])):
+        legs = route.get('legs', [])
+        counts = [_segment_count(leg.get('annotation') or {}) for leg in legs]
+        geometry = route.get('geometry')
+        coords = None
+        if isinstance(geometry, dict):
+            coords = geometry.get('coordinates')
+        if coords is not None and len(coords) != sum(counts) + 1:
+            coords = None
+
+        offset = 0
+        for j, (leg, count) in enumerate(zip(legs, counts)):
+            annotation = leg.get('annotation') or {}
+            for k in range(count):
+                row = {'route': i, 'leg': j, 'segment': k}
+                for name, values in annotation.items():
+                    if isinstance(values, list):
+                        row[name] = values[k] if k < len(values) else None
+                if coords is not None:
+                    start, end = coords[offset + k], coords[offset + k + 1]
+                    row.update(start_lng=start[0], start_lat=start[1],
+                               end_lng=end[0], end_lat=end[1])
+                yield row
+            offset += count
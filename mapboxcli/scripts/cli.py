@@ -2,6 +2,7 @@
 Main click group for CLI
 """
 
+from importlib import import_module
 import logging
 import os
 import sys
@@ -11,8 +12,74 @@ import cligj
 
 import mapboxcli
 from mapboxcli.compat import configparser
-from mapboxcli.scripts import (
-    config, geocoding, directions, mapmatching, uploads, static, datasets)
+from mapboxcli.sessions import SessionFactory
+
+
+# mapbox commands are registered here: command name, module, attribute
+# and short help. Command modules are imported only when invoked so
+# that cheap commands don't pay for importing the mapbox SDK.
+LAZY_COMMANDS = {
+    'config': (
+        'mapboxcli.scripts.config', 'config',
+        "Show all config settings."),
+    'datasets': (
+        'mapboxcli.scripts.datasets', 'datasets',
+        "Read and write Mapbox datasets (has subcommands)"),
+    'directions': (
+        'mapboxcli.scripts.directions', 'directions',
+        "Routing between waypoints"),
+    'geocoding': (
+        'mapboxcli.scripts.geocoding', 'geocoding',
+        "Geocode an address or coordinates."),
+    'mapmatching': (
+        'mapboxcli.scripts.mapmatching', 'match',
+        "Snap GPS traces to OpenStreetMap"),
+    'matrix': (
+        'mapboxcli.scripts.matrix', 'matrix',
+        "Travel time and distance matrices"),
+    'staticmap': (
+        'mapboxcli.scripts.static', 'staticmap',
+        "Static map images."),
+    'upload': (
+        'mapboxcli.scripts.uploads', 'upload',
+        "Upload datasets to Mapbox accounts")}
+
+
+class LazyGroup(click.Group):
+    """A click group that imports subcommands on demand.
+
+    Commands listed in `lazy_commands` are resolved the first time
+    they are looked up. Help output uses the registered short help
+    and imports nothing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, attr, _ = self.lazy_commands[cmd_name]
+            cmd = getattr(import_module(module_name), attr)
+            self.add_command(cmd, cmd_name)
+        return self.commands.get(cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                cmd = self.commands[name]
+                if getattr(cmd, 'hidden', False):
+                    continue
+                rows.append((name, cmd.get_short_help_str()))
+            else:
+                rows.append((name, self.lazy_commands[name][2]))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
 
 
 def configure_logging(verbosity):
@@ -30,7 +97,7 @@ def read_config(cfg):
     return rv
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
 @click.version_option(version=mapboxcli.__version__, message='%(version)s')
 @cligj.verbose_opt
 @cligj.quiet_opt
@@ -39,8 +106,11 @@ def read_config(cfg):
               resolve_path=True),
               help="Config file (default: '{0}/mapbox.ini'".format(
                   click.get_app_dir('mapbox')))
+@click.option('--async', 'use_async', is_flag=True, default=False,
+              help="Make batch requests on an asyncio event loop instead "
+                   "of threads. Requires Python 3 and aiohttp.")
 @click.pass_context
-def main_group(ctx, verbose, quiet, access_token, config):
+def main_group(ctx, verbose, quiet, access_token, config, use_async):
     """This is the command line interface to Mapbox web services.
 
     Mapbox web services require an access token. Your token is shown
@@ -70,6 +140,12 @@ def main_group(ctx, verbose, quiet, access_token, config):
       ~/.config/mapbox/mapbox.ini
       ~/.mapbox/mapbox.ini
 
+    Commands that make many requests, like geocoding with --concurrency,
+    use a pool of threads. With --async they use an asyncio event loop
+    in a single thread instead, which scales to thousands of requests
+    in flight. The geocoding, matrix and directions --batch commands
+    support --async.
+
     """
     ctx.obj = {}
     config = config or os.path.join(click.get_app_dir('mapbox'), 'mapbox.ini')
@@ -92,13 +168,6 @@ def main_group(ctx, verbose, quiet, access_token, config):
 
     ctx.obj['verbosity'] = verbosity
     ctx.obj['access_token'] = access_token
+    ctx.obj['async'] = use_async
+    ctx.obj['sessions'] = SessionFactory(access_token)
 
-
-# mapbox commands are added here.
-main_group.add_command(config.config)
-main_group.add_command(geocoding.geocoding)
-main_group.add_command(directions.directions)
-main_group.add_command(mapmatching.match)
-main_group.add_command(uploads.upload)
-main_group.add_command(static.staticmap)
-main_group.add_command(datasets.datasets)
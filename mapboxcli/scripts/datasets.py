@@ -6,6 +6,7 @@ import click
 
 import mapbox
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.sessions import SessionFactory
 
 
 @click.group(short_help="Read and write Mapbox datasets (has subcommands)")
@@ -19,9 +20,9 @@ def datasets(ctx):
     Note that this API is currently a limited-access beta.
     """
 
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
-    service = mapbox.Datasets(access_token=access_token)
-    ctx.obj['service'] = service
+    sessions = SessionFactory.from_context(ctx)
+    ctx.obj['sessions'] = sessions
+    ctx.obj['service'] = sessions.service(mapbox.Datasets)
 
 
 @datasets.command(short_help="List datasets")
@@ -287,8 +288,7 @@ def create_tileset(ctx, dataset, tileset, name):
     `uploads:write` scope is required, see `mapbox --help`.
     """
 
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
-    service = mapbox.Uploader(access_token=access_token)
+    service = ctx.obj['sessions'].service(mapbox.Uploader)
 
     uri = "mapbox://datasets/{username}/{dataset}".format(
         username=tileset.split('.')[0], dataset=dataset)
@@ -5,7 +5,17 @@ import click
 import cligj
 
 import mapbox
+from mapbox.encoding import read_points
+from requests.exceptions import RequestException
+from mapboxcli import batch, routes, tables
+from mapboxcli.cache import open_cache
+from mapboxcli.choices import (
+    DIRECTIONS_GEOMETRIES, DIRECTIONS_OVERVIEWS, DIRECTIONS_PROFILES)
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.scripts.options import (
+    cache_dir_opt, cache_opt, cache_size_opt, cache_ttl_opt, concurrency_opt,
+    max_retries_opt, unordered_opt)
+from mapboxcli.sessions import SessionFactory
 
 
 def waypoint_snapping_callback(ctx, param, value):
@@ -87,13 +97,167 @@ def waypoint_snapping_callback(ctx, param, value):
     return results
 
 
+def route_waypoints(line):
+    """Parse a line of a batch file into a list of point features.
+
+    The line may be a JSON array of [lng, lat] coordinates, an array
+    of point features, or a feature collection.
+    """
+    data = json.loads(line)
+    if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        data = data.get("features")
+    if not isinstance(data, list):
+        raise ValueError(
+            "Expected an array of waypoints or a feature collection")
+
+    features = []
+    for item in data:
+        if isinstance(item, dict):
+            features.append(item)
+        elif isinstance(item, list) and len(item) >= 2:
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": item[:2]},
+                "properties": {}})
+        else:
+            raise ValueError("Invalid waypoint: {0}".format(
+                json.dumps(item)))
+    return features
+
+
+def request_directions(service, features, options, concurrency=1,
+                       max_waypoints=routes.MAX_WAYPOINTS, cache=None,
+                       precision=5):
+    """Request directions for a list of waypoint features.
+
+    Routes with more than max_waypoints waypoints are split into
+    segments, which are requested concurrently and stitched into one
+    response with a single route. If a segment fails, its response is
+    returned.
+
+    With a cache, the response of each segment is looked up in and
+    stored to it, keyed like a route of the segment's waypoints.
+    """
+    geometries = options.get("geometries")
+    snapping = options.get("waypoint_snapping")
+
+    def request_segment(segment):
+        start, stop = segment
+        segment_features = features[start:stop]
+        segment_options = dict(options)
+        if snapping is not None:
+            segment_options["waypoint_snapping"] = snapping[start:stop]
+        if len(segments) > 1:
+            # Stitching keeps only the first route of each segment.
+            segment_options["alternatives"] = False
+
+        def request():
+            return service.directions(segment_features, **segment_options)
+        if cache is None:
+            return request()
+        return cache.fetch(
+            route_cache_key(
+                cache, segment_features, segment_options, precision),
+            request)
+
+    segments = routes.split_waypoints(len(features), max_waypoints)
+    if len(segments) == 1:
+        return request_segment(segments[0])
+
+    responses = []
+    for res in batch.imap(
+            request_segment, segments, concurrency=concurrency):
+        if res.status_code != 200:
+            return res
+        responses.append(res.json())
+
+    data = routes.stitch_routes(responses, geometries)
+    return batch.Response(
+        200, {"Content-Type": "application/json"},
+        json.dumps(data).encode("utf-8"))
+
+
+def route_cache_key(cache, features, options, precision):
+    """Make the cache key of a route from its waypoint coordinates,
+    rounded to precision decimal places, and its request options."""
+    coords = [[round(lng, precision), round(lat, precision)]
+              for lng, lat in read_points(features)]
+    return cache.key("directions", coords, options)
+
+
+def route_output(service, res, geometries, compact=False, level=None):
+    """Get the output data of a successful directions response.
+
+    Routes are returned as a GeoJSON feature collection if geometries
+    is "geojson" or, with compact, their polyline geometries are
+    decoded locally. With a level of "route", "leg" or "step", the
+    collection has a feature for each route, leg or step. With level
+    "segment", the response's data is returned with decoded geometries.
+    """
+    if level == "segment":
+        return routes.decode_geometries(res.json(), geometries)
+    if level:
+        data = routes.decode_geometries(res.json(), geometries)
+        return {
+            "type": "FeatureCollection",
+            "features": list(routes.iter_features(data, level))}
+    if compact:
+        data = routes.decode_geometries(res.json(), geometries)
+        return service._geojson(data, geom_format="geojson")
+    if geometries == "geojson":
+        return service._geojson(res.json(), geom_format="geojson")
+    return res.json()
+
+
+# Errors of a batch's routes that are written as error records: invalid
+# lines or waypoints, and requests that fail to connect or time out.
+ROUTE_ERRORS = (ValueError, mapbox.errors.ValidationError, RequestException)
+
+
+def route_result(route, service, index, line, geometries, compact=False,
+                 level=None):
+    """Request the route of a line of a batch file with route, a
+    function of a list of waypoint features.
+
+    Returns the output data, or an error record, with the index of the
+    line added.
+    """
+    try:
+        res = route(route_waypoints(line))
+    except ROUTE_ERRORS as exc:
+        res = exc
+    return response_result(service, index, res, geometries, compact, level)
+
+
+def response_result(service, index, res, geometries, compact=False,
+                    level=None):
+    """Get the output data of the response for a line of a batch file,
+    or an error record if the response failed or is an exception, with
+    the index of the line added."""
+    result = {"index": index}
+    if isinstance(res, Exception):
+        result["error"] = str(res)
+        return result
+
+    if res.status_code == 200:
+        result.update(route_output(
+            service, res, geometries, compact, level))
+    else:
+        result["status"] = res.status_code
+        try:
+            result["error"] = res.json()["message"]
+        except (ValueError, KeyError, TypeError):
+            result["error"] = res.text.strip()
+    return result
+
+
 @click.command(short_help="Routing between waypoints")
 
 @cligj.features_in_arg
 
 @click.option(
     "--profile",
-    type=click.Choice(mapbox.Directions.valid_profiles),
+    type=click.Choice(DIRECTIONS_PROFILES),
     default="mapbox/driving",
     help="Routing profile"
 )
@@ -106,7 +270,7 @@ def waypoint_snapping_callback(ctx, param, value):
 
 @click.option(
     "--geometries",
-    type=click.Choice(mapbox.Directions.valid_geom_encoding),
+    type=click.Choice(DIRECTIONS_GEOMETRIES),
     default="geojson",
     help="Format of returned geometry"
 )
@@ -114,15 +278,23 @@ def waypoint_snapping_callback(ctx, param, value):
 # Directions.valid_geom_overview contains two 
 # elements of type str and one element of type bool.  
 # This causes the Directions CLI's --help option to 
-# raise a TypeError.  To prevent this, we convert
-# the bool to a str.
+# raise a TypeError.  To prevent this, DIRECTIONS_OVERVIEWS
+# has the bool converted to a str.
 
 @click.option(
     "--overview",
-    type=click.Choice(str(item) for item in mapbox.Directions.valid_geom_overview),
+    type=click.Choice(DIRECTIONS_OVERVIEWS),
     help="Type of returned overview geometry"
 )
 
+@click.option(
+    "--compact-geometry",
+    is_flag=True,
+    default=False,
+    help="Request compact polyline6 geometry and convert it to GeoJSON "
+         "locally"
+)
+
 @click.option(
     "--steps/--no-steps",
     default=True,
@@ -159,21 +331,165 @@ def waypoint_snapping_callback(ctx, param, value):
     help="Save output to a file"
 )
 
+@click.option(
+    "--simplify",
+    type=click.FloatRange(0, None),
+    default=None,
+    metavar="TOLERANCE",
+    help="Simplify route and step geometries with a tolerance in degrees"
+)
+
+@click.option(
+    "--precision",
+    type=click.IntRange(0, None),
+    default=None,
+    help="Round geometry coordinates to this many decimal places"
+)
+
+@click.option(
+    "--features",
+    "feature_level",
+    type=click.Choice(["route", "leg", "step"]),
+    default=None,
+    help="Write line-delimited GeoJSON features, one per route, leg or "
+         "step"
+)
+
+@click.option(
+    "--segments",
+    "segment_format",
+    type=click.Choice(tables.TABLE_FORMATS),
+    default=None,
+    help="Write a table of the annotations of each route segment. Arrow "
+         "and Parquet require pyarrow"
+)
+
+@click.option(
+    "--batch",
+    "batch_file",
+    default=None,
+    help="Route each line of a file (or '-' for stdin) and write "
+         "line-delimited results"
+)
+
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Request and cache each leg of a route separately. Requires "
+         "--cache"
+)
+
+@click.option(
+    "--cache-precision",
+    type=click.IntRange(0, 6),
+    default=5,
+    help="Decimal places of waypoint coordinates that distinguish cached "
+         "routes [default: 5]"
+)
+
+@concurrency_opt
+@max_retries_opt
+@unordered_opt
+@cache_opt
+@cache_dir_opt
+@cache_ttl_opt
+@cache_size_opt
 @click.pass_context
 def directions(ctx, features, profile, alternatives, 
-               geometries, overview, steps, continue_straight, 
-               waypoint_snapping, annotations, language, output):
+               geometries, compact_geometry, overview, steps,
+               continue_straight, waypoint_snapping, annotations,
+               language, output, simplify, precision, feature_level,
+               segment_format, batch_file, incremental, cache_precision,
+               concurrency, max_retries, unordered, cache, cache_dir,
+               cache_ttl, cache_size):
     """The Mapbox Directions API will show you how to get
        where you're going.
 
        mapbox directions "[0, 0]" "[1, 1]"
 
+       Routes with more than 25 waypoints are split into segments
+       that share their end waypoints. The segments are requested
+       concurrently with --concurrency and stitched into one route:
+       legs and waypoints are concatenated, distances and durations
+       summed, and geometries joined. Stitched routes have no
+       alternatives.
+
+       With --compact-geometry, routes are output as with --geometries
+       geojson but their geometry is transferred in the smaller
+       polyline6 encoding (or the polyline encoding chosen with
+       --geometries) and decoded locally.
+
+       With --simplify, route and step geometries are simplified with
+       the Douglas-Peucker algorithm before they are written, keeping
+       the positions farther than a tolerance in degrees from the
+       simplified line. With --precision, their coordinates are rounded
+       to a number of decimal places. Polyline geometries are
+       simplified and encoded again. Cached responses are kept at full
+       resolution.
+
+       mapbox directions --simplify 0.0001 --precision 5 "[0, 0]" "[1, 1]"
+
+       With --features, a GeoJSON feature is written per line for each
+       route, leg or step instead of one document for the response.
+       Features have the members of their route, leg or step as
+       properties, with "route", "leg" and "step" indexes. Leg
+       geometries are joined from their steps, and are null with
+       --no-steps.
+
+       mapbox directions --features step "[0, 0]" "[1, 1]"
+
+       With --segments, the annotations of the routes are written as a
+       table in CSV, Arrow or Parquet format with a row for each
+       segment of a route's geometry between consecutive coordinates.
+       Rows have "route", "leg" and "segment" indexes, the coordinates
+       of the segment's ends, and a column for each of the
+       --annotations, which are required. The table is written a route
+       at a time. The full overview geometry is requested unless
+       --overview is given.
+
+       \b
+       mapbox directions --annotations duration,speed --segments csv \\
+           "[0, 0]" "[1, 1]"
+
+       With --batch, each line of a file is a route: a JSON array of
+       waypoint coordinates, an array of point features, or a feature
+       collection. Routes are requested concurrently and one JSON
+       result is written per line with an "index" member giving its
+       line number, starting at 0. Routes that fail, including those
+       whose requests fail to connect or time out, are written as
+       records with an "error" member instead. With --features, the
+       features of a route are written with an "index" property, and
+       with --segments, rows have an "index" column and error records
+       are written to stderr.
+
+       mapbox directions --batch routes.txt --concurrency 8
+
+       With --cache, responses are saved in a local database and
+       reused by later requests for the same waypoints and options
+       until they expire. Waypoints are compared after rounding
+       their coordinates to --cache-precision decimal places.
+
+       With --incremental, each leg of a route is requested and cached
+       as a route between its two waypoints, and the legs are stitched
+       into one route. When a waypoint of a cached route is moved or
+       inserted, only the legs that end at changed waypoints are
+       requested again. Cache hits and misses count legs.
+
+       mapbox directions --cache --incremental --batch plans.txt
+
+       With the --async option of "mapbox", the routes of a batch are
+       requested on an asyncio event loop, except for routes of more
+       than 25 waypoints and routes requested with --incremental, which
+       are requested with threads. A single route is requested as usual.
+
        An access token is required.  See "mapbox --help".
     """
 
-    access_token = (ctx.obj and ctx.obj.get("access_token")) or None
-
-    service = mapbox.Directions(access_token=access_token)
+    throttle = batch.AdaptiveLimit(concurrency, retries=max_retries)
+    sessions = SessionFactory.from_context(ctx)
+    sessions.configure(pool_size=concurrency, limit=throttle)
+    service = sessions.service(mapbox.Directions)
 
     # The Directions SDK expects False to be
     # a bool, not a str.
@@ -181,37 +497,246 @@ def directions(ctx, features, profile, alternatives,
     if overview == "False":
         overview = False
 
-    # When using waypoint snapping, the 
-    # Directions SDK expects features to be 
-    # a list, not a generator.
-
-    if waypoint_snapping is not None:
-        features = list(features)
-
     if annotations:
         annotations = annotations.split(",")
 
-    stdout = click.open_file(output, "w")
+    if compact_geometry and geometries == "geojson":
+        geometries = "polyline6"
+
+    # Annotations are aligned with the full geometry.
+    if segment_format and overview is None:
+        overview = "full"
+
+    options = dict(
+        profile=profile,
+        alternatives=alternatives,
+        geometries=geometries,
+        overview=overview,
+        steps=steps,
+        continue_straight=continue_straight,
+        waypoint_snapping=waypoint_snapping,
+        annotations=annotations,
+        language=language
+    )
+
+    if incremental and not cache:
+        raise click.UsageError("--incremental requires --cache")
+
+    if cache:
+        cache = open_cache(
+            "directions", cache_dir=cache_dir, ttl=cache_ttl,
+            max_entries=cache_size)
+    else:
+        cache = None
+
+    def fetch_route(features, concurrency=1):
+        """Get the response for a route, from the cache if possible."""
+        if incremental:
+            return request_directions(
+                service, features, options, concurrency=concurrency,
+                max_waypoints=2, cache=cache, precision=cache_precision)
+
+        def request():
+            return request_directions(
+                service, features, options, concurrency=concurrency)
+        if cache is None:
+            return request()
+        return cache.fetch(
+            route_cache_key(cache, features, options, cache_precision),
+            request)
+
+    def route(features, concurrency=1):
+        """Get the response for a route with simplified geometries."""
+        return simplified(fetch_route(features, concurrency=concurrency))
+
+    def simplified(res):
+        """Simplify the geometries of a response."""
+        if res.status_code != 200 or not (simplify or precision is not None):
+            return res
+        data = routes.simplify_geometries(
+            res.json(), geometries, simplify, precision)
+        return batch.Response(
+            200, {"Content-Type": "application/json"},
+            json.dumps(data).encode("utf-8"))
+
+    if segment_format and feature_level:
+        raise click.UsageError("--features can't be used with --segments")
+    if segment_format and simplify:
+        raise click.UsageError("--simplify can't be used with --segments")
+    if segment_format and not annotations:
+        raise click.UsageError("--segments requires --annotations")
+
+    if segment_format:
+        try:
+            tables.check_format(segment_format)
+        except ImportError as exc:
+            raise click.BadParameter(str(exc), param_hint="--segments")
+        level = "segment"
+    else:
+        level = feature_level
+
+    if batch_file and ctx.obj and ctx.obj.get("async"):
+        try:
+            from mapboxcli import aio
+        except (ImportError, SyntaxError):
+            raise click.UsageError("--async requires Python 3 and aiohttp")
+
+        engine = aio.AsyncEngine(
+            concurrency,
+            headers={"User-Agent": service.session.headers["User-Agent"]},
+            limit=throttle)
+        # Requests are recorded with a service of their own, whose
+        # session is replaced while recording, so that threads
+        # requesting long routes aren't affected.
+        recorder = sessions.service(mapbox.Directions)
+
+        def parsed(line):
+            try:
+                return route_waypoints(line)
+            except ValueError as exc:
+                return exc
+
+        def record(item):
+            features = item[1]
+            if isinstance(features, Exception):
+                raise features
+            return aio.record_request(
+                recorder, lambda: recorder.directions(features, **options))
+
+        def fallback(item):
+            # Long and incremental routes take several requests.
+            features = item[1]
+            if isinstance(features, Exception) or not (
+                    incremental or len(features) > routes.MAX_WAYPOINTS):
+                return None
+            return lambda: fetch_route(features)
+
+        fetcher = aio.paired(aio.Fetcher(
+            engine, record, cache=cache,
+            cache_key=lambda item: route_cache_key(
+                cache, item[1], options, cache_precision),
+            fallback=fallback, errors=ROUTE_ERRORS + aio.CLIENT_ERRORS))
+
+        def route_lines(lines):
+            """Yield the results of the (index, line) pairs of a
+            batch."""
+            items = ((index, parsed(line)) for index, line in lines)
+            with engine:
+                for item, res in batch.imap(
+                        fetcher, items, concurrency=concurrency,
+                        ordered=not unordered, executor=engine):
+                    if not isinstance(res, Exception):
+                        res = simplified(res)
+                    yield response_result(
+                        service, item[0], res, geometries,
+                        compact_geometry, level)
+    else:
+        def route_lines(lines):
+            """Yield the results of the (index, line) pairs of a
+            batch."""
+            return batch.imap(
+                lambda item: route_result(
+                    route, service, item[0], item[1], geometries,
+                    compact_geometry, level),
+                lines, concurrency=concurrency, ordered=not unordered)
+
+    if segment_format in ("arrow", "parquet"):
+        stdout = click.open_file(output, "wb")
+    else:
+        stdout = click.open_file(output, "w")
+
+    table = None
+    try:
+        if segment_format:
+            table = tables.TableWriter(
+                stdout,
+                routes.segment_fields(annotations, index=bool(batch_file)),
+                segment_format, types=routes.SEGMENT_TYPES)
+        write_routes(
+            ctx, route, route_lines, service, features, geometries,
+            compact_geometry, level, batch_file, stdout, concurrency, table)
+    finally:
+        if table is not None:
+            table.close()
+        if cache:
+            cache.close()
+        if ctx.obj and ctx.obj.get("verbosity", 0) >= 0:
+            if cache:
+                click.echo("Cache: {0} hits, {1} misses".format(
+                    cache.hits, cache.misses), err=True)
+            if throttle.throttled:
+                click.echo(
+                    "Rate limited: {0} responses, concurrency {1} of "
+                    "{2}".format(throttle.throttled, throttle.limit,
+                                 concurrency),
+                    err=True)
+
+
+def write_routes(ctx, route, route_lines, service, features, geometries,
+                 compact, level, batch_file, stdout, concurrency,
+                 table=None):
+    """Write the route of the features, or of each line of a batch
+    file.
+
+    route_lines is a function of the (index, line) pairs of a batch
+    file that yields their results. With level "segment", the segment
+    rows of each route are written to the table, a TableWriter.
+    """
+    if batch_file:
+        lines = (
+            (index, line) for index, line in
+            enumerate(click.open_file(batch_file, encoding="utf-8"))
+            if line.strip())
+        errors = 0
+        for result in route_lines(lines):
+            if "error" in result:
+                errors += 1
+                if level == "segment":
+                    # Keep error records out of the table.
+                    click.echo(json.dumps(result), err=True)
+                    continue
+            elif level == "segment":
+                rows = list(routes.iter_segments(result))
+                for row in rows:
+                    row["index"] = result["index"]
+                table.write_rows(rows)
+                continue
+            elif level:
+                # Features carry the index of their line.
+                for feature in result["features"]:
+                    feature["properties"]["index"] = result["index"]
+                    click.echo(json.dumps(feature), file=stdout)
+                continue
+            click.echo(json.dumps(result), file=stdout)
+
+        if errors and ctx.obj and ctx.obj.get("verbosity", 0) >= 0:
+            click.echo("Errors: {0} routes failed".format(errors), err=True)
+        return
+
+    # When using waypoint snapping, the 
+    # Directions SDK expects features to be 
+    # a list, not a generator. Long routes
+    # are split into segments of the list.
+
+    features = list(features)
 
     try:
-        res = service.directions(
-            features,
-            profile=profile,
-            alternatives=alternatives,
-            geometries=geometries,
-            overview=overview,
-            steps=steps,
-            continue_straight=continue_straight,
-            waypoint_snapping=waypoint_snapping,
-            annotations=annotations,
-            language=language
-        )
+        res = route(features, concurrency=concurrency)
     except mapbox.errors.ValidationError as exc:
         raise click.BadParameter(str(exc))
 
     if res.status_code == 200:
-        if geometries == "geojson":
-            click.echo(json.dumps(res.geojson()), file=stdout)
+        if level == "segment":
+            table.write_rows(list(routes.iter_segments(
+                route_output(service, res, geometries, level=level))))
+        elif level:
+            for feature in route_output(
+                    service, res, geometries, level=level)["features"]:
+                click.echo(json.dumps(feature), file=stdout)
+        elif geometries == "geojson" or compact:
+            click.echo(
+                json.dumps(route_output(service, res, geometries, compact)),
+                file=stdout)
         else:
             click.echo(res.text, file=stdout)
     else:
@@ -1,24 +1,57 @@
+from array import array
+from collections import OrderedDict
+import csv
+import hashlib
+import io
 import logging
-from itertools import chain
+from itertools import chain, islice, tee
 import json
+import os
 import re
 
 import click
+import cligj
 import mapbox
 from mapbox import Geocoder
+import six
+from six.moves.urllib.parse import quote
 
-from mapboxcli.compat import map
+from mapboxcli import batch
+from mapboxcli.cache import cached, open_cache
+from mapboxcli.choices import GEOCODING_DATASETS, GEOCODING_PLACE_TYPES
+from mapboxcli.compat import json_codec, map
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.scripts.options import (
+    cache_dir_opt, cache_opt, cache_size_opt, cache_ttl_opt, concurrency_opt,
+    json_backend_opt, max_retries_opt, unordered_opt)
+from mapboxcli.sessions import SessionFactory
+
+
+logger = logging.getLogger(__name__)
 
 
 def iter_query(query):
     """Accept a filename, stream, or string.
-    Returns an iterator over lines of the query."""
+    Yields the query's non-blank lines, stripped of whitespace.
+
+    Lines are read one at a time so that large files don't have to
+    fit in memory and queries from a pipe are processed as soon as
+    they arrive."""
     try:
-        itr = click.open_file(query).readlines()
+        src = click.open_file(query)
     except IOError:
-        itr = [query]
-    return itr
+        yield query
+        return
+    with src:
+        for line in iter(src.readline, ''):
+            line = line.strip()
+            if line:
+                yield line
+
+
+def normalize_query(query):
+    """Normalize case and whitespace of a forward geocoding query."""
+    return ' '.join(query.lower().split())
 
 
 def coords_from_query(query):
@@ -31,11 +64,146 @@ def coords_from_query(query):
     return tuple(coords[:2])
 
 
+def parse_coords(lines):
+    """Parse a block of reverse geocoding query lines.
+
+    Lines may be JSON arrays or comma or space separated pairs, like
+    the queries accepted by coords_from_query. Returns an array of
+    alternating longitudes and latitudes of the valid lines and a list
+    of the indexes of the invalid lines.
+    """
+    tokens = []
+    errors = []
+    for i, line in enumerate(lines):
+        parts = line.replace(',', ' ').replace('[', ' ').replace(
+            ']', ' ').split()
+        if len(parts) < 2:
+            errors.append(i)
+        else:
+            tokens.append(parts[0])
+            tokens.append(parts[1])
+    try:
+        # Convert all the values in one pass.
+        return array('d', map(float, tokens)), errors
+    except ValueError:
+        pass
+
+    # Find the lines with invalid numbers.
+    coords = array('d')
+    errors = set(errors)
+    pairs = iter(zip(tokens[::2], tokens[1::2]))
+    for i in range(len(lines)):
+        if i in errors:
+            continue
+        lng, lat = next(pairs)
+        try:
+            coords.extend((float(lng), float(lat)))
+        except ValueError:
+            errors.add(i)
+    return coords, sorted(errors)
+
+
+def iter_coords(lines, block_size=1000):
+    """Transform query lines into (lng, lat) pairs of coordinates,
+    parsing them in blocks.
+
+    Use a block_size of 1 for lines from a pipe, so that each query is
+    parsed as soon as it arrives. The queries before an invalid one are
+    yielded, then click.BadParameter is raised naming it.
+    """
+    for start, block in enumerate(batch.chunks(lines, block_size)):
+        coords, errors = parse_coords(block)
+        valid = len(coords) if not errors else 2 * errors[0]
+        for i in range(0, valid, 2):
+            yield coords[i], coords[i + 1]
+        if errors:
+            raise click.BadParameter(
+                "Invalid coordinates in query {0}: {1!r}".format(
+                    start * block_size + errors[0] + 1, block[errors[0]]),
+                param_hint='query')
+
+
+def snap_coords(coords, precision):
+    """Snap a (lng, lat) pair to a grid with a spacing of 10**-precision
+    decimal degrees."""
+    return tuple(round(c, precision) for c in coords)
+
+
+# The maximum number of queries in one request to the batch endpoint
+# of the mapbox.places-permanent dataset.
+MAX_BATCH_SIZE = 50
+
+
+def batch_request(geocoder, queries, forward, params):
+    """Make one request for several queries to the permanent dataset's
+    batch endpoint.
+
+    Returns a list of responses, one per query, or None if the request
+    fails or its response can't be split.
+    """
+    if forward:
+        parts = [quote(q.encode('utf-8'), safe='') for q in queries]
+    else:
+        precision = Geocoder.precision['reverse']
+        parts = ['{0},{1}'.format(*snap_coords(coords, precision))
+                 for coords in queries]
+    uri = '{0}/{1}/{2}.json'.format(
+        geocoder.baseuri, geocoder.name, ';'.join(parts))
+    resp = geocoder.session.get(uri, params=params)
+    if resp.status_code != 200:
+        return None
+    try:
+        collections = json.loads(resp.text)
+    except ValueError:
+        return None
+    if not isinstance(collections, list) or len(collections) != len(queries):
+        return None
+    return [batch.Response(200, resp.headers, json.dumps(c).encode('utf-8'))
+            for c in collections]
+
+
+def result_values(collection, fields, missing=''):
+    """Get the values of fields of a collection's first feature.
+
+    The fields 'lon' and 'lat' are the feature's center. Other fields
+    are top level members of the feature. Lists are joined with commas
+    and missing values are replaced by `missing`.
+    """
+    features = collection.get('features') or [{}]
+    feature = features[0]
+    values = []
+    for field in fields:
+        if field in ('lon', 'lat'):
+            center = feature.get('center') or [None, None]
+            value = center[0 if field == 'lon' else 1]
+        else:
+            value = feature.get(field)
+        if isinstance(value, list):
+            value = ','.join(str(v) for v in value)
+        values.append(missing if value is None else value)
+    return values
+
+
+def csv_line(values):
+    """Format a CSV line as UTF-8 encoded bytes."""
+    if six.PY2:
+        # Python 2's csv module writes byte strings.
+        buf = io.BytesIO()
+        csv.writer(buf, lineterminator='\n').writerow(
+            [v.encode('utf-8') if isinstance(v, six.text_type) else v
+             for v in values])
+        return buf.getvalue()
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerow(values)
+    return buf.getvalue().encode('utf-8')
+
+
 def echo_headers(headers, file=None):
-    """Echo headers, sorted."""
+    """Echo headers, sorted, as UTF-8 encoded bytes."""
     for k, v in sorted(headers.items()):
-        click.echo("{0}: {1}".format(k.title(), v), file=file)
-    click.echo(file=file)
+        click.echo(
+            "{0}: {1}".format(k.title(), v).encode('utf-8'), file=file)
+    click.echo(b'', file=file)
 
 
 @click.command(short_help="Geocode an address or coordinates.")
@@ -57,11 +225,11 @@ def echo_headers(headers, file=None):
          "is also required.")
 @click.option(
     '--place-type', '-t', multiple=True, metavar='NAME', default=None,
-    type=click.Choice(Geocoder().place_types.keys()),
+    type=click.Choice(GEOCODING_PLACE_TYPES),
     help="Restrict results to one or more place types.")
 @click.option('--output', '-o', default='-', help="Save output to a file.")
 @click.option('--dataset', '-d', default='mapbox.places',
-              type=click.Choice(("mapbox.places", "mapbox.places-permanent")),
+              type=click.Choice(GEOCODING_DATASETS),
               help="Source dataset for geocoding, [default: mapbox.places]")
 @click.option('--country', default=None,
               help="Restrict forward geocoding to specified country codes,"
@@ -74,9 +242,50 @@ def echo_headers(headers, file=None):
                    "not a FeatureCollection")
 @click.option('--limit', type=int, default=None,
               help="Limit the number of returned features")
+@click.option('--input-format', type=click.Choice(['text', 'csv', 'geojson']),
+              default='text',
+              help="Format of the query file. CSV and GeoJSON input is "
+                   "written out with result fields added. [default: text]")
+@click.option('--address-column', multiple=True, metavar='NAME',
+              default=['address'],
+              help="CSV column(s) forming the address. Multiple columns are "
+                   "joined with commas. [default: address]")
+@click.option('--lon-column', default='lon', metavar='NAME',
+              help="CSV column of reverse query longitudes. [default: lon]")
+@click.option('--lat-column', default='lat', metavar='NAME',
+              help="CSV column of reverse query latitudes. [default: lat]")
+@click.option('--result-fields', default='lon,lat,place_name,relevance',
+              help="Comma-separated fields of the top result to add to CSV "
+                   "rows or GeoJSON feature properties. "
+                   "[default: lon,lat,place_name,relevance]")
+@click.option('--batch-size', type=click.IntRange(1, MAX_BATCH_SIZE),
+              default=1,
+              help="Number of queries per request to the batch endpoint of "
+                   "mapbox.places-permanent. [default: 1]")
+@click.option('--reverse-precision', type=click.IntRange(0, 5), default=None,
+              help="Snap reverse geocoding queries to a grid of this many "
+                   "decimal places and make one request per grid cell.")
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help="Record progress in this file and resume from it. "
+                   "Requires --output.")
+@click.option('--checkpoint-interval', type=click.IntRange(1, None),
+              default=1000,
+              help="Queries between checkpoints. [default: 1000]")
+@json_backend_opt
+@concurrency_opt
+@max_retries_opt
+@unordered_opt
+@cache_opt
+@cache_dir_opt
+@cache_ttl_opt
+@cache_size_opt
 @click.pass_context
 def geocoding(ctx, query, forward, include_headers, lat, lon,
-              place_type, output, dataset, country, bbox, features, limit):
+              place_type, output, dataset, country, bbox, features, limit,
+              input_format, address_column, lon_column, lat_column,
+              result_fields, batch_size, reverse_precision, checkpoint,
+              checkpoint_interval, json_backend, concurrency, max_retries,
+              unordered, cache, cache_dir, cache_ttl, cache_size):
     """This command returns places matching an address (forward mode) or
     places matching coordinates (reverse mode).
 
@@ -90,12 +299,217 @@ def geocoding(ctx, query, forward, include_headers, lat, lon,
 
       $ mapbox geocoding --reverse '[-77.4371, 37.5227]'
 
+    Dense reverse queries can share results: with --reverse-precision 3
+    coordinates are rounded to 3 decimal places (about 100 meters) and
+    one request is made for all the points in each grid cell.
+
+    The query argument may also be a file (or '-' for stdin) with one
+    query per line. Use --concurrency to make several requests at once.
+    Results are written in input order unless --unordered is given.
+
+      $ mapbox geocoding --concurrency 8 addresses.txt
+
+    Concurrency adapts to the API's rate limit: it is halved when
+    requests are rate limited and raised again, up to --concurrency,
+    while the rate limit has room. Rate limited requests are retried
+    after a pause, up to --max-retries times. Changes are logged with
+    -v.
+
+    The mapbox.places-permanent dataset accepts up to 50 queries in one
+    request. Use --batch-size to group queries in this way. Batches that
+    fail are retried one query at a time.
+
+    \b
+      $ mapbox geocoding -d mapbox.places-permanent --batch-size 50 \\
+      >     addresses.txt
+
+    CSV files can be geocoded in one pass. Addresses are taken from
+    --address-column (or coordinates from --lon-column and --lat-column
+    in reverse mode) and rows are written with the --result-fields of
+    the top result appended as columns prefixed with "result_". Rows
+    without a query, or with invalid coordinates, get empty result
+    columns. Invalid coordinates are logged as warnings.
+
+    \b
+      $ mapbox geocoding --input-format csv --address-column street \\
+      >     --address-column city customers.csv
+
+    Point features can be reverse geocoded in the same way. The input
+    may be a GeoJSON feature collection or a sequence of features and
+    each feature is written out on its own line with the result fields
+    added to its properties. Features that aren't points are written
+    out unchanged.
+
+      $ mapbox geocoding --reverse --input-format geojson points.geojson
+
+    Long batches can be resumed. With --checkpoint, the number of
+    completed queries is recorded as results are written to the
+    --output file. If the command is interrupted, running it again
+    with the same input and options skips the completed queries and
+    appends to the output. A checkpoint isn't resumed with a different
+    input, output or options. The checkpoint file is removed when the
+    command finishes.
+
+      $ mapbox geocoding --checkpoint job.ckpt -o out.json addresses.txt
+
+    Duplicate queries in the input are requested only once. With
+    --cache, responses are saved in a local database and reused
+    by later runs until they expire.
+
     An access token is required, see `mapbox --help`.
     """
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
-    stdout = click.open_file(output, 'w')
+    use_async = ctx.obj and ctx.obj.get('async')
+
+    if batch_size > 1 and dataset != 'mapbox.places-permanent':
+        raise click.BadParameter(
+            "Batches require the mapbox.places-permanent dataset",
+            param_hint='--batch-size')
+    if batch_size > 1 and use_async:
+        raise click.UsageError("--batch-size can't be used with --async")
+    if checkpoint and output == '-':
+        raise click.BadParameter(
+            "Checkpoints require an output file", param_hint='--checkpoint')
+    if checkpoint and unordered:
+        raise click.UsageError("--checkpoint can't be used with --unordered")
+    if input_format == 'geojson' and forward:
+        raise click.UsageError("GeoJSON input requires --reverse")
+    if input_format != 'text' and (unordered or features or include_headers):
+        raise click.UsageError(
+            "--unordered, --features and --include can't be used with "
+            "{0} input".format(input_format))
 
-    geocoder = Geocoder(name=dataset, access_token=access_token)
+    try:
+        loads, dumps = json_codec(json_backend)
+    except ImportError as exc:
+        raise click.BadParameter(str(exc), param_hint='--json-backend')
+
+    if checkpoint:
+        # Options that only tune the run may change when resuming.
+        tuning = ('query', 'output', 'checkpoint', 'checkpoint_interval',
+                  'concurrency', 'max_retries', 'cache', 'cache_dir',
+                  'cache_ttl', 'cache_size')
+        options = dict(
+            (k, v) for k, v in ctx.params.items() if k not in tuning)
+        job = {
+            'input': (os.path.abspath(query) if os.path.isfile(query)
+                      else query),
+            'output': os.path.abspath(output),
+            'options': hashlib.sha1(json.dumps(
+                options, sort_keys=True).encode('utf-8')).hexdigest()}
+        checkpoint = batch.Checkpoint(
+            checkpoint, checkpoint_interval, job=job)
+        try:
+            done, offset = checkpoint.load()
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint='--checkpoint')
+    else:
+        done = offset = 0
+
+    if done:
+        if not os.path.exists(output):
+            raise click.BadParameter(
+                "Output file {0} of checkpoint is missing".format(output),
+                param_hint='--checkpoint')
+        # Discard output written after the last checkpoint.
+        stdout = open(output, 'r+b')
+        stdout.truncate(offset)
+        stdout.seek(offset)
+    else:
+        # Responses are written as bytes, without decoding and encoding
+        # them, unless they are transformed.
+        stdout = click.open_file(output, 'wb')
+
+    if input_format == 'csv':
+        try:
+            reader = csv.DictReader(click.open_file(query))
+            fieldnames = reader.fieldnames or []
+        except IOError:
+            raise click.BadParameter(
+                "CSV input must be a file or '-'", param_hint='query')
+        columns = address_column if forward else (lon_column, lat_column)
+        for column in columns:
+            if column not in fieldnames:
+                raise click.BadParameter(
+                    "No column named {0}".format(column),
+                    param_hint='query')
+        result_fields = [f.strip() for f in result_fields.split(',')]
+
+        def record_query(row, line=None):
+            """Return the query of a CSV row or None. Rows with invalid
+            coordinates have no query, and are logged with their line
+            number if it is given."""
+            if forward:
+                parts = [row[c].strip() for c in address_column
+                         if (row[c] or '').strip()]
+                return ', '.join(parts) or None
+            lon_value = (row[lon_column] or '').strip()
+            lat_value = (row[lat_column] or '').strip()
+            if not (lon_value or lat_value):
+                return None
+            try:
+                return float(lon_value), float(lat_value)
+            except ValueError:
+                if line is not None:
+                    logger.warning("Invalid coordinates on line %d", line)
+                return None
+
+        def write_record(row, collection):
+            values = [row.get(f, '') for f in fieldnames]
+            if collection is not None:
+                values += result_values(collection, result_fields)
+            else:
+                values += [''] * len(result_fields)
+            stdout.write(csv_line(values))
+
+        if not done:
+            stdout.write(csv_line(
+                fieldnames + ['result_' + f for f in result_fields]))
+
+        records, records_out = tee(islice(reader, done, None))
+        # The reader runs ahead of the queries, so lines are counted
+        # here, after the header.
+        lines = (q for q in (record_query(r, line) for line, r in
+                             enumerate(records, done + 2))
+                 if q is not None)
+
+    elif input_format == 'geojson':
+        result_fields = [f.strip() for f in result_fields.split(',')]
+
+        def record_query(feature):
+            """Return the coordinates of a point feature or None."""
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') != 'Point':
+                return None
+            return tuple(geometry['coordinates'][:2])
+
+        def write_record(feature, collection):
+            if collection is not None:
+                properties = feature.get('properties') or {}
+                properties.update(zip(
+                    ['result_' + f for f in result_fields],
+                    result_values(collection, result_fields, missing=None)))
+                feature['properties'] = properties
+            stdout.write(dumps(feature) + b'\n')
+
+        records, records_out = tee(islice(
+            cligj.normalize_feature_inputs(None, 'query', [query]),
+            done, None))
+        lines = (q for q in map(record_query, records) if q is not None)
+
+    else:
+        lines = islice(iter_query(query), done, None)
+
+    throttle = batch.AdaptiveLimit(concurrency, retries=max_retries)
+    sessions = SessionFactory.from_context(ctx)
+    sessions.configure(pool_size=concurrency, limit=throttle)
+    geocoder = sessions.service(Geocoder, name=dataset)
+
+    if cache:
+        cache = open_cache(
+            'geocoding', cache_dir=cache_dir, ttl=cache_ttl,
+            max_entries=cache_size)
+    else:
+        cache = None
 
     if forward:
         if country:
@@ -107,41 +521,231 @@ def geocoding(ctx, query, forward, include_headers, lat, lon,
             except ValueError:
                 bbox = json.loads(bbox)
 
-        for q in iter_query(query):
-            try:
-                resp = geocoder.forward(
-                    q, types=place_type, lat=lat, lon=lon,
-                    country=country, bbox=bbox, limit=limit)
-            except mapbox.errors.ValidationError as exc:
-                raise click.BadParameter(str(exc))
-
-            if include_headers:
-                echo_headers(resp.headers, file=stdout)
-            if resp.status_code == 200:
-                if features:
-                    collection = json.loads(resp.text)
-                    for feat in collection['features']:
-                        click.echo(json.dumps(feat), file=stdout)
-                else:
-                    click.echo(resp.text, file=stdout)
-            else:
-                raise MapboxCLIException(resp.text.strip())
+        def geocode(q):
+            return geocoder.forward(
+                q, types=place_type, lat=lat, lon=lon,
+                country=country, bbox=bbox, limit=limit)
+
+        def batch_params():
+            params = {}
+            if country:
+                params.update(geocoder._validate_country_codes(country))
+            if place_type:
+                params.update(geocoder._validate_place_types(place_type))
+            if lon is not None and lat is not None:
+                params.update(proximity='{0},{1}'.format(
+                    round(lon, Geocoder.precision['proximity']),
+                    round(lat, Geocoder.precision['proximity'])))
+            if bbox is not None:
+                params.update(bbox='{0},{1},{2},{3}'.format(*bbox))
+            if limit is not None:
+                params.update(limit='{0}'.format(limit))
+            return params
+
+        def cache_key(q):
+            return cache.key(
+                'forward', dataset, normalize_query(q), sorted(place_type),
+                country, bbox, lon, lat, limit)
+
+        queries = lines
+
+    else:
+        def geocode(coords):
+            lon, lat = coords
+            return geocoder.reverse(
+                lon=lon, lat=lat, types=place_type, limit=limit)
+
+        def batch_params():
+            params = {}
+            if place_type:
+                params.update(geocoder._validate_place_types(place_type))
+            if limit is not None:
+                if len(place_type) != 1:
+                    raise mapbox.errors.InvalidPlaceTypeError(
+                        "Specify a single type when using limit with "
+                        "reverse geocoding")
+                params.update(limit='{0}'.format(limit))
+            return params
+
+        def cache_key(coords):
+            precision = Geocoder.precision['reverse']
+            return cache.key(
+                'reverse', dataset, round(coords[0], precision),
+                round(coords[1], precision), sorted(place_type), limit)
+
+        if input_format == 'text':
+            # Lines from stdin or a pipe are parsed as they arrive.
+            queries = iter_coords(
+                lines, block_size=1000 if os.path.isfile(query) else 1)
+        else:
+            queries = lines
+
+    # Duplicate queries are requested once. Forward queries are compared
+    # after normalization and reverse queries by their coordinates.
+    if forward:
+        coalesce_key = normalize_query
     else:
-        for lon, lat in map(coords_from_query, iter_query(query)):
+        coalesce_key = tuple
+        if reverse_precision is not None:
+            queries = map(
+                lambda coords: snap_coords(coords, reverse_precision),
+                queries)
+
+    # Skips duplicate queries and counts the requests saved.
+    coalescer = None
+
+    if batch_size > 1:
+        # Duplicates are skipped across the whole run, not only within
+        # a chunk. Chunks own the keys they claim first.
+        coalescer = batch.Coalescer(None, key=coalesce_key)
+
+        def geocode_chunk(chunk):
+            """Geocode a chunk of queries with as few requests as
+            possible. Returns a list of responses."""
+            keys = [coalesce_key(q) for q in chunk]
+            futures = {}
+            owned = OrderedDict()
+            for key, q in zip(keys, chunk):
+                future, owner = coalescer.claim(key)
+                futures[key] = future
+                if owner:
+                    owned[key] = q
+
             try:
-                resp = geocoder.reverse(
-                    lon=lon, lat=lat, types=place_type, limit=limit)
-            except mapbox.errors.ValidationError as exc:
-                raise click.BadParameter(str(exc))
-
-            if include_headers:
-                echo_headers(resp.headers, file=stdout)
-            if resp.status_code == 200:
-                if features:
-                    collection = json.loads(resp.text)
-                    for feat in collection['features']:
-                        click.echo(json.dumps(feat), file=stdout)
+                results = {}
+                misses = []
+                for key, q in owned.items():
+                    resp = cache.get(cache_key(q)) if cache else None
+                    if resp is None:
+                        misses.append((key, q))
+                    else:
+                        results[key] = resp
+
+                # Forward queries containing the separator can't be
+                # batched.
+                batchable = [(key, q) for key, q in misses
+                             if not forward or ';' not in q]
+                if len(batchable) > 1:
+                    split = batch_request(
+                        geocoder, [q for key, q in batchable], forward,
+                        batch_params())
+                    for (key, q), resp in zip(batchable, split or []):
+                        results[key] = resp
+                        if cache:
+                            cache.set(cache_key(q), resp)
+
+                for key, q in misses:
+                    if key not in results:
+                        resp = results[key] = geocode(q)
+                        if cache:
+                            cache.set(cache_key(q), resp)
+            except Exception as exc:
+                for key in owned:
+                    if not futures[key].done():
+                        futures[key].set_exception(exc)
+                raise
+
+            for key in owned:
+                futures[key].set_result(results[key])
+            return [futures[key].result() for key in keys]
+
+        def iter_responses():
+            for resps in batch.imap(
+                    geocode_chunk, batch.chunks(queries, batch_size),
+                    concurrency=concurrency, ordered=not unordered):
+                for resp in resps:
+                    yield resp
+
+        responses = iter_responses()
+
+    elif use_async:
+        try:
+            from mapboxcli import aio
+        except (ImportError, SyntaxError):
+            raise click.UsageError("--async requires Python 3 and aiohttp")
+
+        engine = aio.AsyncEngine(
+            concurrency,
+            headers={'User-Agent': geocoder.session.headers['User-Agent']},
+            limit=throttle)
+        coalescer = aio.Fetcher(
+            engine,
+            lambda item: aio.record_request(geocoder, lambda: geocode(item)),
+            cache=cache, cache_key=cache_key, coalesce_key=coalesce_key)
+
+        def iter_responses():
+            with engine:
+                for resp in batch.imap(
+                        coalescer, queries, concurrency=concurrency,
+                        ordered=not unordered, executor=engine):
+                    yield resp
+
+        responses = iter_responses()
+
+    else:
+        coalescer = batch.Coalescer(
+            cached(cache, geocode, cache_key), key=coalesce_key)
+        responses = batch.imap(
+            coalescer, queries, concurrency=concurrency,
+            ordered=not unordered)
+
+    try:
+        if input_format == 'text':
+            for resp in responses:
+                if include_headers:
+                    echo_headers(resp.headers, file=stdout)
+                if resp.status_code == 200:
+                    if features:
+                        collection = loads(resp.content)
+                        for feat in collection['features']:
+                            stdout.write(dumps(feat) + b'\n')
+                    else:
+                        stdout.write(resp.content + b'\n')
                 else:
-                    click.echo(resp.text, file=stdout)
-            else:
-                raise MapboxCLIException(resp.text.strip())
+                    raise MapboxCLIException(resp.text.strip())
+                done += 1
+                if checkpoint:
+                    # The end of the last completed record, where a
+                    # resumed job continues.
+                    offset = stdout.tell()
+                    checkpoint.update(done, stdout, offset)
+        else:
+            # Records and responses are paired in input order. Records
+            # without a query have no response.
+            for record in records_out:
+                collection = None
+                if record_query(record) is not None:
+                    resp = next(responses)
+                    if resp.status_code != 200:
+                        raise MapboxCLIException(resp.text.strip())
+                    collection = loads(resp.content)
+                write_record(record, collection)
+                done += 1
+                if checkpoint:
+                    offset = stdout.tell()
+                    checkpoint.update(done, stdout, offset)
+        if checkpoint:
+            checkpoint.remove()
+            checkpoint = None
+    except mapbox.errors.ValidationError as exc:
+        raise click.BadParameter(str(exc))
+    finally:
+        responses.close()
+        stdout.flush()
+        if checkpoint:
+            checkpoint.save(done, stdout, offset)
+        if cache:
+            cache.close()
+        if ctx.obj and ctx.obj.get('verbosity', 0) >= 0:
+            if coalescer is not None and coalescer.saved:
+                click.echo("Duplicate queries: {0} requests saved".format(
+                    coalescer.saved), err=True)
+            if cache:
+                click.echo("Cache: {0} hits, {1} misses".format(
+                    cache.hits, cache.misses), err=True)
+            if throttle.throttled:
+                click.echo(
+                    "Rate limited: {0} responses, concurrency {1} of "
+                    "{2}".format(throttle.throttled, throttle.limit,
+                                 concurrency),
+                    err=True)
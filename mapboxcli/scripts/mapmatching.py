@@ -2,14 +2,16 @@ import click
 import cligj
 
 import mapbox
+from mapboxcli.choices import MAPMATCHING_PROFILES
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.sessions import SessionFactory
 
 @click.command('mapmatching', short_help="Snap GPS traces to OpenStreetMap")
 @cligj.features_in_arg
 @click.option("--gps-precision", default=4, type=int,
               help="Assumed precision of tracking device (default 4 meters)")
 @click.option('--profile', default="mapbox.driving",
-              type=click.Choice(mapbox.MapMatcher().valid_profiles),
+              type=click.Choice(MAPMATCHING_PROFILES),
               help="Mapbox profile id")
 @click.pass_context
 def match(ctx, features, profile, gps_precision):
@@ -20,14 +22,13 @@ to the OpenStreetMap road and path network.
 
 An access token is required, see `mapbox --help`.
     """
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
-
     features = list(features)
     if len(features) != 1:
         raise click.BadParameter(
             "Mapmatching requires a single LineString feature")
 
-    service = mapbox.MapMatcher(access_token=access_token)
+    sessions = SessionFactory.from_context(ctx)
+    service = sessions.service(mapbox.MapMatcher)
     try:
         res = service.match(
             features[0],
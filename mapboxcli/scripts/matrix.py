@@ -0,0 +1,241 @@
+# Travel time and distance matrices.
+
+from array import array
+import json
+import struct
+import sys
+
+import click
+import cligj
+
+import mapbox
+from mapbox.encoding import encode_waypoints
+from mapboxcli import batch
+from mapboxcli.choices import MATRIX_PROFILES
+from mapboxcli.errors import MapboxCLIException
+from mapboxcli.scripts.options import concurrency_opt, max_retries_opt
+from mapboxcli.sessions import SessionFactory
+
+
+# The maximum number of coordinates in one Matrix API request.
+MAX_COORDINATES = 25
+MAX_TRAFFIC_COORDINATES = 10
+
+
+def tile_shape(sources, destinations, max_coordinates):
+    """Choose the numbers of sources and destinations of the tiles of
+    a matrix, so that a tile has at most max_coordinates in all.
+
+    Tiles are square unless one side of the matrix is short, in which
+    case the other side gets the rest of the coordinates.
+    """
+    half = max_coordinates // 2
+    rows = min(sources, max(half, max_coordinates - destinations))
+    cols = min(destinations, max_coordinates - rows)
+    return rows, cols
+
+
+def matrix_tiles(sources, destinations, max_coordinates):
+    """Yield the (row, col, rows, cols) offsets and sizes of tiles
+    that cover a matrix of sources by destinations."""
+    rows, cols = tile_shape(sources, destinations, max_coordinates)
+    for row in range(0, sources, rows):
+        for col in range(0, destinations, cols):
+            yield (row, col, min(rows, sources - row),
+                   min(cols, destinations - col))
+
+
+def tile_url(service, profile, sources, destinations, annotations):
+    """Return the URL and query parameters of the Matrix API request
+    for a tile, without the session's parameters."""
+    coords = list(sources) + list(destinations)
+    uri = '{0}/{1}/{2}'.format(
+        service.baseuri, profile, encode_waypoints(coords))
+    params = {
+        'sources': ';'.join(str(i) for i in range(len(sources))),
+        'destinations': ';'.join(
+            str(i) for i in range(len(sources), len(coords))),
+        'annotations': ','.join(annotations)}
+    return uri, params
+
+
+def tile_request(service, profile, sources, destinations, annotations):
+    """Request the matrix of a tile from the Matrix API.
+
+    The SDK's DirectionsMatrix doesn't take annotations, so the
+    request is made with the service's session.
+    """
+    uri, params = tile_url(
+        service, profile, sources, destinations, annotations)
+    return service.session.get(uri, params=params)
+
+
+def write_npy(f, arrays, shape):
+    """Write arrays of doubles, concatenated, as a NumPy .npy file of
+    the given shape (format version 1.0)."""
+    header = "{{'descr': '<f8', 'fortran_order': False, 'shape': {0}, }}"
+    header = header.format(repr(tuple(shape)))
+    # The header is padded so that the data is 64 byte aligned.
+    pad = 63 - (10 + len(header)) % 64
+    header = (header + ' ' * pad + '\n').encode('latin-1')
+    f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header)
+    for values in arrays:
+        if sys.byteorder != 'little':
+            values = array('d', values)
+            values.byteswap()
+        f.write(values.tobytes() if hasattr(values, 'tobytes')
+                else values.tostring())
+
+
+@click.command(short_help="Travel time and distance matrices")
+@click.option('--origins', required=True,
+              help="Origin points: a GeoJSON file, '-' for stdin, or a "
+                   "'[lng, lat]' pair.")
+@click.option('--destinations', default=None,
+              help="Destination points, like --origins. [default: the "
+                   "origins]")
+@click.option('--profile', type=click.Choice(MATRIX_PROFILES),
+              default='mapbox/driving',
+              help="Routing profile. [default: mapbox/driving]")
+@click.option('--annotations', multiple=True,
+              type=click.Choice(['duration', 'distance']),
+              default=['duration', 'distance'],
+              help="Matrices to compute. [default: duration and distance]")
+@click.option('--format', 'output_format', type=click.Choice(['json', 'npy']),
+              default='json', help="Output format. [default: json]")
+@click.option('--output', '-o', default='-', help="Save output to a file.")
+@concurrency_opt
+@max_retries_opt
+@click.pass_context
+def matrix(ctx, origins, destinations, profile, annotations, output_format,
+           output, concurrency, max_retries):
+    """Compute matrices of travel times and distances from origin
+    points to destination points.
+
+      $ mapbox matrix --origins depots.geojson --destinations stops.geojson
+
+    Matrices larger than one request allows (25 coordinates, or 10 with
+    the mapbox/driving-traffic profile) are split into tiles that are
+    requested concurrently with --concurrency and assembled. With the
+    --async option of "mapbox", tiles are requested on an asyncio event
+    loop instead of threads.
+
+    JSON output has "durations" (seconds) and "distances" (meters)
+    members, arrays of rows with one row per origin and null where
+    there is no route. NumPy .npy output is an array of doubles with
+    NaN where there is no route. Its shape is (origins, destinations),
+    or (2, origins, destinations) with durations first if both
+    annotations are requested.
+
+      $ mapbox matrix --origins points.geojson --format npy -o m.npy
+
+    An access token is required, see `mapbox --help`.
+    """
+    # Keep the API's order of annotations.
+    annotations = [a for a in ('duration', 'distance') if a in annotations]
+
+    sources = list(cligj.normalize_feature_inputs(ctx, 'origins', [origins]))
+    if destinations:
+        targets = list(cligj.normalize_feature_inputs(
+            ctx, 'destinations', [destinations]))
+    else:
+        targets = sources
+    if not sources or not targets:
+        raise click.BadParameter(
+            "Origins and destinations are required", param_hint='--origins')
+
+    if profile == 'mapbox/driving-traffic':
+        max_coordinates = MAX_TRAFFIC_COORDINATES
+    else:
+        max_coordinates = MAX_COORDINATES
+
+    throttle = batch.AdaptiveLimit(concurrency, retries=max_retries)
+    sessions = SessionFactory.from_context(ctx)
+    sessions.configure(pool_size=concurrency, limit=throttle)
+    service = sessions.service(mapbox.DirectionsMatrix)
+
+    rows, cols = len(sources), len(targets)
+    matrices = [array('d', [float('nan')]) * (rows * cols)
+                for a in annotations]
+
+    def tile_args(tile):
+        row, col, height, width = tile
+        return (service, profile, sources[row:row + height],
+                targets[col:col + width], annotations)
+
+    if ctx.obj and ctx.obj.get('async'):
+        try:
+            from mapboxcli import aio
+        except (ImportError, SyntaxError):
+            raise click.UsageError("--async requires Python 3 and aiohttp")
+
+        engine = aio.AsyncEngine(
+            concurrency,
+            headers={'User-Agent': service.session.headers['User-Agent']},
+            limit=throttle)
+
+        def record(tile):
+            uri, params = tile_url(*tile_args(tile))
+            merged = dict(service.session.params)
+            merged.update(params)
+            return uri, merged
+
+        fetcher = aio.Fetcher(engine, record)
+
+        def iter_results():
+            # Results are in input order and are paired with their tiles.
+            tiles = list(matrix_tiles(rows, cols, max_coordinates))
+            with engine:
+                for item in zip(tiles, batch.imap(
+                        fetcher, tiles, concurrency=concurrency,
+                        executor=engine)):
+                    yield item
+
+        results = iter_results()
+    else:
+        def fetch(tile):
+            return tile, tile_request(*tile_args(tile))
+
+        results = batch.imap(
+            fetch, matrix_tiles(rows, cols, max_coordinates),
+            concurrency=concurrency, ordered=False)
+
+    try:
+        for (row, col, height, width), res in results:
+            if res.status_code != 200:
+                raise MapboxCLIException(res.text.strip())
+            data = res.json()
+            for annotation, values in zip(annotations, matrices):
+                tile_rows = data.get(annotation + 's') or []
+                for i, tile_row in enumerate(tile_rows):
+                    start = (row + i) * cols + col
+                    for j, value in enumerate(tile_row):
+                        if value is not None:
+                            values[start + j] = value
+    except mapbox.errors.ValidationError as exc:
+        raise click.BadParameter(str(exc))
+    finally:
+        # Stops the requests in flight and the engine, if any.
+        results.close()
+
+    stdout = click.open_file(output, 'wb')
+    if output_format == 'npy':
+        if len(matrices) == 1:
+            shape = (rows, cols)
+        else:
+            shape = (len(matrices), rows, cols)
+        write_npy(stdout, matrices, shape)
+    else:
+        collection = {}
+        for annotation, values in zip(annotations, matrices):
+            collection[annotation + 's'] = [
+                [None if v != v else v
+                 for v in values[i * cols:(i + 1) * cols]]
+                for i in range(rows)]
+        stdout.write(json.dumps(collection).encode('utf-8') + b'\n')
+
+    if ctx.obj and ctx.obj.get('verbosity', 0) >= 0 and throttle.throttled:
+        click.echo(
+            "Rate limited: {0} responses, concurrency {1} of {2}".format(
+                throttle.throttled, throttle.limit, concurrency),
+            err=True)
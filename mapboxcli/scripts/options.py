@@ -0,0 +1,42 @@
+# Options shared by mapbox commands.
+
+import os
+
+import click
+
+
+concurrency_opt = click.option(
+    '--concurrency', type=click.IntRange(1, None), default=1,
+    help="Maximum number of concurrent requests. [default: 1]")
+
+max_retries_opt = click.option(
+    '--max-retries', type=click.IntRange(0, None), default=5,
+    help="Retries of rate limited requests. [default: 5]")
+
+unordered_opt = click.option(
+    '--unordered', is_flag=True, default=False,
+    help="Write results as they arrive instead of in input order.")
+
+cache_opt = click.option(
+    '--cache/--no-cache', default=False,
+    help="Reuse responses saved in a local cache. [default: no-cache]")
+
+cache_dir_opt = click.option(
+    '--cache-dir', type=click.Path(file_okay=False, resolve_path=True),
+    default=None,
+    help="Cache directory (default: '{0}')".format(
+        os.path.join(click.get_app_dir('mapbox'), 'cache')))
+
+cache_ttl_opt = click.option(
+    '--cache-ttl', type=click.IntRange(0, None), default=30 * 24 * 3600,
+    help="Seconds that cached responses remain valid. [default: 30 days]")
+
+cache_size_opt = click.option(
+    '--cache-size', type=click.IntRange(1, None), default=100000,
+    help="Maximum number of cached responses. [default: 100000]")
+
+json_backend_opt = click.option(
+    '--json-backend', type=click.Choice(['json', 'orjson']), default='json',
+    help="Library used to parse and write JSON when results are "
+         "transformed. orjson must be installed separately. "
+         "[default: json]")
@@ -3,6 +3,7 @@ import cligj
 
 import mapbox
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.sessions import SessionFactory
 
 
 @click.command(short_help="Static map images.")
@@ -25,12 +26,12 @@ def staticmap(ctx, mapid, output, features, lat, lon, zoom, size):
 
     An access token is required, see `mapbox --help`.
     """
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
     if features:
         features = list(
             cligj.normalize_feature_inputs(None, 'features', [features]))
 
-    service = mapbox.Static(access_token=access_token)
+    sessions = SessionFactory.from_context(ctx)
+    service = sessions.service(mapbox.Static)
 
     try:
         res = service.image(
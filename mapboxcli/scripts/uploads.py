@@ -6,6 +6,7 @@ import click
 
 import mapbox
 from mapboxcli.errors import MapboxCLIException
+from mapboxcli.sessions import SessionFactory
 
 
 @click.command(short_help="Upload datasets to Mapbox accounts")
@@ -37,9 +38,8 @@ def upload(ctx, tileset, datasource, name, patch):
     Your account must be flagged in order to use the patch mode
     feature.
     """
-    access_token = (ctx.obj and ctx.obj.get('access_token')) or None
-
-    service = mapbox.Uploader(access_token=access_token)
+    sessions = SessionFactory.from_context(ctx)
+    service = sessions.service(mapbox.Uploader)
 
     if name is None:
         name = tileset.split(".")[-1]
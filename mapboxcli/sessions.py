@@ -0,0 +1,71 @@
+# HTTP session shared by the mapbox services of a command.
+
+import os
+
+
+class SessionFactory(object):
+    """Makes one HTTP session for all the mapbox services that a
+    command uses.
+
+    Services made by the factory share the session's pool of
+    kept-alive connections, so requests after the first to a host
+    reuse a connection instead of repeating the TLS handshake. The
+    session is created on first use, so commands that make no
+    requests don't import the SDK or requests.
+    """
+
+    def __init__(self, access_token=None, pool_size=1):
+        self.access_token = access_token
+        self.pool_size = pool_size
+        self.limit = None
+        self._session = None
+
+    @classmethod
+    def from_context(cls, ctx):
+        """Return the factory made by the main group for a click
+        context, or a new one for a command invoked on its own."""
+        obj = ctx.obj or {}
+        return obj.get('sessions') or cls(obj.get('access_token'))
+
+    @property
+    def session(self):
+        """The shared requests session."""
+        if self._session is None:
+            from mapbox.services.base import Session
+            session = Session(self.access_token)
+            session.headers.update({
+                'Accept-Encoding': 'gzip, deflate',
+                'Connection': 'keep-alive'})
+            self._session = session
+            self._mount()
+        return self._session
+
+    def configure(self, pool_size=None, limit=None):
+        """Size the connection pool, usually to match the concurrency
+        of a command, and send requests within a
+        mapboxcli.batch.AdaptiveLimit if one is given."""
+        if pool_size is not None:
+            self.pool_size = pool_size
+        self.limit = limit
+        if self._session is not None:
+            self._mount()
+
+    def service(self, cls, **kwargs):
+        """Make a mapbox service of class cls that uses the shared
+        session. Keyword arguments are set as attributes of the
+        service, such as a Geocoder's name.
+
+        The service's constructor isn't called, since it would make a
+        session of its own only for it to be replaced. The attributes
+        it sets up are set here instead.
+        """
+        service = cls.__new__(cls)
+        service.session = self.session
+        service.host = os.environ.get('MAPBOX_HOST', cls.default_host)
+        for name, value in kwargs.items():
+            setattr(service, name, value)
+        return service
+
+    def _mount(self):
+        from mapboxcli.batch import mount_pool
+        mount_pool(self._session, self.pool_size, self.limit)
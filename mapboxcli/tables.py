@@ -0,0 +1,104 @@
+# Columnar output of rows of records.
+
+import csv
+import json
+
+
+# Formats written by TableWriter.
+TABLE_FORMATS = ('csv', 'arrow', 'parquet')
+
+# Column types. Values of str columns that are objects are written as
+# JSON.
+COLUMN_TYPES = ('int', 'float', 'str')
+
+
+def check_format(table_format):
+    """Raise ImportError if the libraries that write a table format
+    are not installed."""
+    if table_format in ('arrow', 'parquet'):
+        try:
+            import pyarrow
+            if table_format == 'parquet':
+                import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is not installed")
+
+
+def _text(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class TableWriter(object):
+    """Writes rows of records to a file in one of TABLE_FORMATS, a
+    chunk of rows at a time, so that a table needn't fit in memory.
+
+    Rows are dicts and fieldnames are the table's columns. Keys of
+    rows that aren't columns are ignored and missing values are null,
+    or empty in CSV. types maps column names to one of COLUMN_TYPES
+    and other columns are str. CSV is written to a text file, and
+    Arrow IPC and Parquet files, which require pyarrow, to binary
+    files. Each chunk is a record batch of an Arrow file or a row
+    group of a Parquet file.
+    """
+
+    def __init__(self, f, fieldnames, table_format='csv', types=None):
+        self.f = f
+        self.fieldnames = list(fieldnames)
+        self.table_format = table_format
+        self.types = [(types or {}).get(name, 'str')
+                      for name in self.fieldnames]
+        if table_format == 'csv':
+            self._writer = csv.writer(f, lineterminator='\n')
+            self._writer.writerow(self.fieldnames)
+        else:
+            self._writer = self._open_arrow()
+
+    def _open_arrow(self):
+        check_format(self.table_format)
+        import pyarrow
+        import pyarrow.ipc
+        arrow_types = {
+            'int': pyarrow.int64(), 'float': pyarrow.float64(),
+            'str': pyarrow.string()}
+        self._schema = pyarrow.schema(
+            [(name, arrow_types[t])
+             for name, t in zip(self.fieldnames, self.types)])
+        if self.table_format == 'parquet':
+            import pyarrow.parquet
+            return pyarrow.parquet.ParquetWriter(self.f, self._schema)
+        return pyarrow.ipc.new_file(self.f, self._schema)
+
+    def write_rows(self, rows):
+        """Write a chunk of rows."""
+        if not rows:
+            return
+        if self.table_format == 'csv':
+            for row in rows:
+                self._writer.writerow([
+                    '' if row.get(name) is None else _text(row[name])
+                    for name in self.fieldnames])
+            return
+
+        import pyarrow
+        columns = []
+        for name, t in zip(self.fieldnames, self.types):
+            values = [row.get(name) for row in rows]
+            if t == 'str':
+                values = [None if v is None else _text(v) for v in values]
+            columns.append(values)
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(values, type=field.type)
+             for values, field in zip(columns, self._schema)],
+            schema=self._schema)
+        if self.table_format == 'parquet':
+            self._writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        """Finish the file. Arrow and Parquet files are unreadable
+        until they are closed."""
+        if self.table_format != 'csv':
+            self._writer.close()
@@ -35,9 +35,12 @@ setup(name='mapboxcli',
           'click',
           'click-plugins',
           'cligj>=0.4',
+          'futures; python_version < "3"',
           'mapbox==0.16.1',
           'six'],
       extras_require={
+          'arrow': ['pyarrow'],
+          'async': ['aiohttp; python_version >= "3.5"'],
           'test': ['coveralls', 'pytest>=2.8', 'pytest-cov', 'responses',
                    'mock']},
       entry_points="""
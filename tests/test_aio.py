@@ -0,0 +1,219 @@
+import json
+import threading
+
+from click.testing import CliRunner
+from mock import patch
+import pytest
+
+from mapboxcli.batch import AdaptiveLimit, Response, imap
+from mapboxcli.scripts.cli import main_group
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import mapbox
+
+import mapboxcli
+from mapboxcli.aio import AsyncEngine, Fetcher, record_request
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+
+    # Paths starting with /limited are rate limited on first request.
+    limited = set()
+
+    def do_GET(self):
+        if self.path.startswith('/directions-matrix'):
+            return self.send_matrix()
+        if (self.path.startswith('/limited') and
+                self.path not in self.limited):
+            self.limited.add(self.path)
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_matrix(self):
+        # A matrix of the tile's source index times 100 plus its
+        # destination index.
+        query = parse_qs(urlsplit(self.path).query)
+        sources = [int(i) for i in query['sources'][0].split(';')]
+        destinations = [int(i) for i in query['destinations'][0].split(';')]
+        body = json.dumps({"durations": [
+            [100 * i + j for j in range(len(destinations))]
+            for i in range(len(sources))]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), EchoHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_record_request():
+    geocoder = mapbox.Geocoder(access_token='pk.test')
+    session = geocoder.session
+    url, params = record_request(
+        geocoder, lambda: geocoder.forward('lolwut', limit=2))
+    assert url == (
+        'https://api.mapbox.com/geocoding/v5/mapbox.places/lolwut.json')
+    assert params == {'access_token': 'pk.test', 'limit': '2'}
+    assert geocoder.session is session
+
+
+def test_record_request_validation():
+    geocoder = mapbox.Geocoder(access_token='pk.test')
+    with pytest.raises(mapbox.errors.ValidationError):
+        record_request(
+            geocoder, lambda: geocoder.forward('lolwut', types=['spaceship']))
+
+
+def test_engine_imap(server):
+    with AsyncEngine(concurrency=4) as engine:
+        fetcher = Fetcher(
+            engine, lambda item: (server + '/' + item, {'q': 1}))
+        results = list(imap(
+            fetcher, ['a', 'b', 'c', 'd', 'e'], concurrency=4,
+            executor=engine))
+    assert [r.status_code for r in results] == [200] * 5
+    assert [r.json()['path'] for r in results] == [
+        '/{0}?q=1'.format(x) for x in 'abcde']
+
+
+def test_engine_limit(server):
+    limit = AdaptiveLimit(4)
+    with AsyncEngine(concurrency=4, limit=limit) as engine:
+        fetcher = Fetcher(
+            engine, lambda item: (server + '/limited/' + item, {}))
+        results = list(imap(
+            fetcher, ['a', 'b', 'c'], concurrency=4, executor=engine))
+    assert [r.status_code for r in results] == [200] * 3
+    assert limit.throttled == 3
+    assert limit.in_flight == 0
+
+
+def test_fetcher_coalesce(server):
+    recorded = []
+
+    def record(item):
+        recorded.append(item)
+        return server + '/' + item, {}
+
+    with AsyncEngine(concurrency=2) as engine:
+        fetcher = Fetcher(engine, record, coalesce_key=str.lower)
+        results = list(imap(
+            fetcher, ['a', 'A', 'b', 'a'], concurrency=2, executor=engine))
+    assert [r.json()['path'] for r in results] == ['/a', '/a', '/b', '/a']
+    assert sorted(recorded) == ['a', 'b']
+    assert fetcher.saved == 2
+
+
+def test_fetcher_fallback(server):
+    def record(item):
+        if item == 'bad':
+            raise ValueError(item)
+        return server + '/' + item, {}
+
+    def fallback(item):
+        if item == 'long':
+            return lambda: threading.current_thread()
+
+    with AsyncEngine(concurrency=2) as engine:
+        fetcher = Fetcher(
+            engine, record, fallback=fallback, errors=(ValueError,))
+        a, bad, thread = list(imap(
+            fetcher, ['a', 'bad', 'long'], concurrency=2, executor=engine))
+    assert a.json()['path'] == '/a'
+    assert isinstance(bad, ValueError)
+    assert thread not in (threading.main_thread(), engine._thread)
+
+
+@patch.dict('sys.modules', {'mapboxcli.aio': None})
+def test_cli_geocode_async_unavailable(monkeypatch):
+    monkeypatch.delattr(mapboxcli, 'aio')
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group, ['--async', 'geocoding', 'lolwut'])
+    assert result.exit_code == 2
+    assert "requires Python 3 and aiohttp" in result.output
+
+
+def test_cli_matrix_async(server, monkeypatch):
+    monkeypatch.setattr(
+        mapbox.DirectionsMatrix, 'baseuri',
+        server + '/directions-matrix/v1')
+    points = ['[{0}, 0]'.format(i) for i in range(15)]
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'pk.test', '--async', 'matrix',
+         '--origins', '-', '--annotations', 'duration', '--concurrency',
+         '4'],
+        input='\n'.join(
+            '{{"type": "Point", "coordinates": {0}}}'.format(p)
+            for p in points),
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    durations = json.loads(result.output)['durations']
+    # 15 by 15 is split into 12 by 13 tiles.
+    assert len(durations) == 15
+    assert durations[0][:3] == [0, 1, 2]
+    assert durations[13][14] == 101
+
+
+def test_cli_directions_batch_async(server, monkeypatch):
+    monkeypatch.setattr(
+        mapbox.Directions, 'baseuri', server + '/directions/v5')
+    threads = []
+
+    def request_directions(service, features, options, **kwargs):
+        threads.append(threading.current_thread())
+        return Response(200, {}, b'{"routes": []}')
+
+    monkeypatch.setattr(
+        'mapboxcli.scripts.directions.request_directions',
+        request_directions)
+    long_route = json.dumps([[i, 0] for i in range(30)])
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'pk.test', '--async', 'directions',
+         '--geometries', 'polyline', '--batch', '-', '--concurrency', '2'],
+        input='[[0, 0], [1, 1]]\nlolwut\n{0}\n[[2, 2], [3, 3]]\n'.format(
+            long_route),
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines()
+               if line.startswith('{')]
+    assert [r['index'] for r in records] == [0, 1, 2, 3]
+    assert records[0]['path'].startswith(
+        '/directions/v5/mapbox/driving/0.0,0.0;1.0,1.0.json?')
+    assert 'error' in records[1]
+    assert records[2] == {'index': 2, 'routes': []}
+    assert records[3]['path'].startswith(
+        '/directions/v5/mapbox/driving/2.0,2.0;3.0,3.0.json?')
+    # Only the long route is requested in a thread.
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
@@ -0,0 +1,252 @@
+import threading
+import time
+
+import pytest
+
+from mapboxcli.batch import (
+    AdaptiveLimit, Checkpoint, Coalescer, Response, imap)
+
+
+def throttled(headers=None):
+    return Response(429, dict({'Retry-After': '0'}, **(headers or {})), b'')
+
+
+def ok(headers=None):
+    return Response(200, headers or {}, b'{}')
+
+
+def test_imap_serial():
+    assert list(imap(lambda x: x * 2, range(5))) == [0, 2, 4, 6, 8]
+
+
+def test_imap_ordered():
+    def func(x):
+        time.sleep(0.01 * (5 - x))
+        return x
+    assert list(imap(func, range(5), concurrency=5)) == list(range(5))
+
+
+def test_imap_unordered():
+    def func(x):
+        time.sleep(0.01 * (5 - x))
+        return x
+    results = list(imap(func, range(5), concurrency=5, ordered=False))
+    assert sorted(results) == list(range(5))
+    assert results != list(range(5))
+
+
+def test_imap_bounded():
+    """No more than concurrency calls run at once."""
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def func(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+        return x
+
+    assert list(imap(func, range(40), concurrency=3)) == list(range(40))
+    assert peak[0] <= 3
+
+
+def test_imap_lazy():
+    """The input iterable is consumed lazily."""
+    consumed = []
+
+    def items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    results = imap(lambda x: x, items(), concurrency=2)
+    assert next(results) == 0
+    assert len(consumed) < 100
+
+
+def test_imap_error():
+    def func(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+
+    results = imap(func, range(10), concurrency=4)
+    assert [next(results) for i in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_coalescer():
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        return x.upper()
+
+    coalesced = Coalescer(func, key=str.lower)
+    assert [coalesced(x) for x in ['a', 'b', 'A', 'a']] == ['A', 'B', 'A', 'A']
+    assert calls == ['a', 'b']
+    assert coalesced.saved == 2
+
+
+def test_coalescer_concurrent():
+    """Calls in progress are shared between threads."""
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        time.sleep(0.02)
+        return x
+
+    coalesced = Coalescer(func, key=lambda x: x)
+    assert list(imap(coalesced, [1, 1, 1, 2], concurrency=4)) == [1, 1, 1, 2]
+    assert sorted(calls) == [1, 2]
+
+
+def test_coalescer_max_size():
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        return x
+
+    coalesced = Coalescer(func, key=lambda x: x, max_size=2)
+    for x in [1, 2, 3, 1]:
+        coalesced(x)
+    assert calls == [1, 2, 3, 1]
+
+
+def test_coalescer_error():
+    def func(x):
+        raise ValueError(x)
+
+    coalesced = Coalescer(func, key=lambda x: x)
+    for i in range(2):
+        with pytest.raises(ValueError):
+            coalesced(1)
+    assert coalesced.saved == 1
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('job.ckpt'))
+    checkpoint = Checkpoint(path, interval=2)
+    assert checkpoint.load() == (0, 0)
+    with open(str(tmpdir.join('out.txt')), 'wb') as output:
+        output.write(b'a\n')
+        checkpoint.update(1, output, 2)
+        assert Checkpoint(path).load() == (0, 0)
+        output.write(b'b\n')
+        checkpoint.update(2, output, 4)
+        assert Checkpoint(path).load() == (2, 4)
+        output.write(b'c\nd')
+        checkpoint.save(3, output, 6)
+    assert Checkpoint(path).load() == (3, 6)
+    checkpoint.remove()
+    assert not tmpdir.join('job.ckpt').exists()
+
+
+def test_checkpoint_job(tmpdir):
+    path = str(tmpdir.join('job.ckpt'))
+    job = {'input': 'in.txt', 'options': ['a', 1]}
+    with open(str(tmpdir.join('out')), 'wb') as output:
+        Checkpoint(path, job=job).save(1, output, 0)
+    assert Checkpoint(path, job=job).load() == (1, 0)
+    with pytest.raises(ValueError):
+        Checkpoint(path, job=dict(job, input='other.txt')).load()
+
+
+def test_adaptive_limit_decrease():
+    """Responses to requests started before a 429 don't lower the limit
+    again."""
+    limit = AdaptiveLimit(8)
+    tokens = [limit.acquire() for i in range(3)]
+    assert limit.release(tokens[0], throttled())
+    assert limit.limit == 4
+    assert limit.release(tokens[1], throttled())
+    assert limit.limit == 4
+    assert not limit.release(tokens[2], ok())
+    assert limit.release(limit.acquire(), throttled())
+    assert limit.limit == 2
+    assert limit.throttled == 3
+    assert limit.in_flight == 0
+
+
+def test_adaptive_limit_minimum():
+    limit = AdaptiveLimit(2)
+    for i in range(3):
+        limit.release(limit.acquire(), throttled())
+    assert limit.limit == 1
+
+
+def test_adaptive_limit_increase():
+    limit = AdaptiveLimit(4)
+    limit.release(limit.acquire(), throttled())
+    assert limit.limit == 2
+    for i in range(2):
+        limit.release(limit.acquire(), ok())
+    assert limit.limit == 3
+    for i in range(20):
+        limit.release(limit.acquire(), ok())
+    assert limit.limit == 4
+
+
+def test_adaptive_limit_no_headroom():
+    limit = AdaptiveLimit(4)
+    limit.release(limit.acquire(), throttled())
+    headers = {'x-rate-limit-limit': '5', 'x-rate-limit-reset': '1'}
+    for i in range(5):
+        limit.release(limit.acquire(), ok(headers))
+    assert limit.limit == 2
+    limit.release(
+        limit.acquire(), ok({'X-Rate-Limit-Remaining': '100'}))
+    assert limit.limit == 3
+
+
+def test_adaptive_limit_pause():
+    limit = AdaptiveLimit(2)
+    limit.release(limit.acquire(), throttled({'Retry-After': '10'}))
+    token, wait = limit.try_acquire()
+    assert token is None
+    assert 10 <= wait <= 15
+
+
+def test_adaptive_limit_blocks():
+    limit = AdaptiveLimit(1)
+    token = limit.acquire()
+    assert limit.try_acquire() == (None, None)
+    limit.release(token)
+    assert limit.try_acquire()[0] is not None
+
+
+def test_adaptive_limit_call():
+    limit = AdaptiveLimit(4, retries=2)
+    resps = [ok(), throttled(), throttled()]
+    assert limit.call(resps.pop).status_code == 200
+    assert limit.in_flight == 0
+
+
+def test_adaptive_limit_call_retries():
+    limit = AdaptiveLimit(4, retries=2)
+    calls = []
+
+    def func():
+        calls.append(1)
+        return throttled()
+
+    assert limit.call(func).status_code == 429
+    assert len(calls) == 3
+
+
+def test_adaptive_limit_call_error():
+    limit = AdaptiveLimit(1)
+
+    def func():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        limit.call(func)
+    assert limit.in_flight == 0
@@ -0,0 +1,107 @@
+import sqlite3
+import time
+
+from mapboxcli.batch import Response
+from mapboxcli.cache import ResponseCache, cached
+
+
+def response(content, status_code=200):
+    return Response(
+        status_code, {'Content-Type': 'application/json'},
+        content.encode('utf-8'))
+
+
+def test_cache_roundtrip(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('test.sqlite')))
+    key = cache.key('forward', 'lolwut')
+    assert cache.get(key) is None
+    cache.set(key, response('{"lol": "wut"}'))
+    resp = cache.get(key)
+    assert resp.status_code == 200
+    assert resp.headers == {'Content-Type': 'application/json'}
+    assert resp.text == '{"lol": "wut"}'
+    assert resp.json() == {"lol": "wut"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_persistent(tmpdir):
+    path = str(tmpdir.join('test.sqlite'))
+    cache = ResponseCache(path)
+    cache.set('a', response('a'))
+    cache.close()
+    assert ResponseCache(path).get('a').text == 'a'
+
+
+def test_cache_errors_not_stored(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('test.sqlite')))
+    cache.set('a', response('nope', status_code=401))
+    assert cache.get('a') is None
+
+
+def test_cache_ttl(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('test.sqlite')), ttl=0)
+    cache.set('a', response('a'))
+    time.sleep(0.01)
+    assert cache.get('a') is None
+
+
+def test_cache_lru_eviction(tmpdir):
+    path = str(tmpdir.join('test.sqlite'))
+    cache = ResponseCache(path, max_entries=2)
+    cache.set('a', response('a'))
+    cache.set('b', response('b'))
+    time.sleep(0.01)
+    cache.get('a')
+    cache.set('c', response('c'))
+    cache.close()
+    cache = ResponseCache(path)
+    assert cache.get('b') is None
+    assert cache.get('a').text == 'a'
+    assert cache.get('c').text == 'c'
+
+
+def test_cached(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('test.sqlite')))
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        return response(item)
+
+    wrapped = cached(cache, func, lambda item: cache.key(item.lower()))
+    assert wrapped('a').text == 'a'
+    assert wrapped('A').text == 'a'
+    assert calls == ['a']
+    assert cached(None, func, None) is func
+
+
+def test_cache_shared(tmpdir):
+    """Two caches, as in two processes, can use one database."""
+    path = str(tmpdir.join('test.sqlite'))
+    first = ResponseCache(path)
+    second = ResponseCache(path)
+    first.set('a', response('a'))
+    second.set('b', response('b'))
+    assert first.get('b').text == 'b'
+    first.set('c', response('c'))
+    assert second.get('a').text == 'a'
+    second.set('d', response('d'))
+    first.close()
+    second.close()
+    assert ResponseCache(path).get('d').text == 'd'
+
+
+def test_cache_locked(tmpdir, monkeypatch):
+    """A database locked by another writer doesn't raise."""
+    monkeypatch.setattr(ResponseCache, 'busy_timeout', 0.01)
+    path = str(tmpdir.join('test.sqlite'))
+    cache = ResponseCache(path)
+    cache.set('a', response('a'))
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    cache.set('b', response('b'))
+    assert cache.get('a').text == 'a'
+    assert cache.get('b') is None
+    cache.close()
+    other.execute("ROLLBACK")
+    other.close()
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+
+import mapbox
+
+from mapboxcli import choices
+
+
+def test_place_types():
+    assert set(choices.GEOCODING_PLACE_TYPES) == set(
+        mapbox.Geocoder().place_types)
+
+
+def test_directions_profiles():
+    assert set(choices.DIRECTIONS_PROFILES) == set(
+        mapbox.Directions.valid_profiles)
+
+
+def test_directions_geometries():
+    assert set(choices.DIRECTIONS_GEOMETRIES) == set(
+        mapbox.Directions.valid_geom_encoding)
+
+
+def test_directions_overviews():
+    assert set(choices.DIRECTIONS_OVERVIEWS) == set(
+        str(item) for item in mapbox.Directions.valid_geom_overview)
+
+
+def test_matrix_profiles():
+    assert set(choices.MATRIX_PROFILES) == set(
+        mapbox.DirectionsMatrix.valid_profiles)
+
+
+def test_mapmatching_profiles():
+    assert set(choices.MAPMATCHING_PROFILES) == set(
+        mapbox.MapMatcher.valid_profiles)
+
+
+def test_import_constructs_no_services():
+    """Importing command modules creates no HTTP sessions."""
+    code = (
+        "import mapbox.services.base as base\n"
+        "calls = []\n"
+        "session = base.Session\n"
+        "def spy(*args, **kwargs):\n"
+        "    calls.append(args)\n"
+        "    return session(*args, **kwargs)\n"
+        "base.Session = spy\n"
+        "from mapboxcli.scripts import (\n"
+        "    config, datasets, directions, geocoding, mapmatching, matrix,\n"
+        "    static, uploads)\n"
+        "assert not calls, calls\n")
+    subprocess.check_call([sys.executable, '-c', code])
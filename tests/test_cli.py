@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+from mapboxcli.scripts.cli import LAZY_COMMANDS, main_group
+
+
+def test_help_lists_commands():
+    """Help lists every command with its short help."""
+    runner = CliRunner()
+    result = runner.invoke(main_group, ['--help'], catch_exceptions=False)
+    assert result.exit_code == 0
+    for name, (_, _, short_help) in LAZY_COMMANDS.items():
+        assert name in result.output
+        assert short_help in result.output
+
+
+def test_lazy_short_help():
+    """Registered short help matches the commands' own short help."""
+    for name in LAZY_COMMANDS:
+        cmd = main_group.get_command(None, name)
+        assert cmd.short_help == LAZY_COMMANDS[name][2]
+
+
+def test_directions_help_does_not_import_numpy():
+    """NumPy is imported only when a long geometry needs it."""
+    code = (
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from mapboxcli.scripts.cli import main_group\n"
+        "result = CliRunner().invoke(main_group, ['directions', '--help'])\n"
+        "assert result.exit_code == 0, result.output\n"
+        "assert 'mapboxcli.scripts.directions' in sys.modules\n"
+        "assert 'numpy' not in sys.modules\n")
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_config_does_not_import_sdk():
+    """Cheap commands don't import the mapbox SDK."""
+    code = (
+        "import sys\n"
+        "from click.testing import CliRunner\n"
+        "from mapboxcli.scripts.cli import main_group\n"
+        "result = CliRunner().invoke(main_group, ['config'])\n"
+        "assert result.exit_code == 0, result.output\n"
+        "assert 'mapbox' not in sys.modules\n"
+        "assert 'mapboxcli.scripts.geocoding' not in sys.modules\n"
+        "assert 'orjson' not in sys.modules\n")
+    subprocess.check_call([sys.executable, '-c', code])
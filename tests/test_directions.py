@@ -1,11 +1,16 @@
+import json
 import os
+import re
 
 from mapboxcli.scripts.cli import main_group
 from mapboxcli.scripts.directions import waypoint_snapping_callback
 
 from click.testing import CliRunner
+import polyline
 import pytest
+from requests.exceptions import ConnectionError
 import responses
+from six.moves.urllib.parse import unquote
 
 
 GEOJSON_BODY = "{\"routes\": []}"
@@ -1097,3 +1102,447 @@ def test_waypoint_callback(input_snap, expected):
 
     wpt = waypoint_snapping_callback(None, None, (u"1", u"unlimited"))
     assert wpt == [1, "unlimited"]
+
+
+@responses.activate
+def test_cli_directions_batch(tmpdir):
+    responses.add(
+        method=responses.GET,
+        url=re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        body=GEOJSON_BODY,
+        status=200
+    )
+
+    filename = str(tmpdir.join("routes.txt"))
+    with open(filename, "w") as f:
+        f.write("[[0, 0], [1, 1]]\n")
+        f.write("\n")
+        f.write(json.dumps({
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "properties": {},
+                 "geometry": {"type": "Point", "coordinates": [0, 0]}},
+                {"type": "Feature", "properties": {},
+                 "geometry": {"type": "Point", "coordinates": [1, 1]}}]}))
+        f.write("\n")
+        f.write("lolwut\n")
+        f.write("[[0, 0]]\n")
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main_group,
+        [
+            "--access-token", "test-token",
+            "directions",
+            "--batch", filename,
+            "--concurrency", "2",
+            "--output", str(tmpdir.join("out.json"))
+        ]
+    )
+
+    assert result.exit_code == 0
+    assert "Errors: 2 routes failed" in result.output
+    with open(str(tmpdir.join("out.json"))) as f:
+        results = [json.loads(line) for line in f]
+    assert [r["index"] for r in results] == [0, 2, 3, 4]
+    assert results[0]["type"] == "FeatureCollection"
+    assert results[1]["type"] == "FeatureCollection"
+    assert "error" in results[2]
+    assert "error" in results[3]
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_cli_directions_batch_server_error():
+    responses.add(
+        method=responses.GET,
+        url=re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        body="{\"message\": \"No route found\"}",
+        status=422
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main_group,
+        [
+            "--access-token", "test-token",
+            "directions",
+            "--batch", "-"
+        ],
+        input="[[0, 0], [1, 1]]\n"
+    )
+
+    assert result.exit_code == 0
+    assert json.loads(result.output.splitlines()[0]) == {
+        "index": 0, "status": 422, "error": "No route found"}
+
+
+def route_callback(request):
+    """Respond with a straight route through the requested waypoints."""
+    path = unquote(request.path_url.split("?")[0].split("/")[-1])
+    coords = [[float(v) for v in pair.split(",")]
+              for pair in path[:-len(".json")].split(";")]
+    assert len(coords) <= 25
+    if "geometries=polyline" in request.url:
+        precision = 6 if "geometries=polyline6" in request.url else 5
+        geometry = polyline.encode(
+            [(lat, lng) for lng, lat in coords], precision)
+    else:
+        geometry = {"type": "LineString", "coordinates": coords}
+    body = {
+        "code": "Ok",
+        "routes": [{
+            "distance": 10.0 * (len(coords) - 1),
+            "duration": 1.0 * (len(coords) - 1),
+            "geometry": geometry,
+            "legs": [{"distance": 10.0, "duration": 1.0}
+                     for i in range(len(coords) - 1)]}],
+        "waypoints": [{"location": c} for c in coords]}
+    return (200, {}, json.dumps(body))
+
+
+@responses.activate
+def test_cli_directions_chunked():
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main_group,
+        [
+            "--access-token", "test-token",
+            "directions",
+            "--geometries", "polyline",
+            "--concurrency", "2"
+        ] + ["[{0}, 0]".format(i) for i in range(60)]
+    )
+
+    assert result.exit_code == 0
+    data = json.loads(result.output)
+    route, = data["routes"]
+    assert len(route["legs"]) == 59
+    assert route["distance"] == 590.0
+    assert route["duration"] == 59.0
+    assert polyline.decode(route["geometry"]) == [
+        (0.0, float(i)) for i in range(60)]
+    assert len(data["waypoints"]) == 60
+    assert len(responses.calls) == 3
+    for call in responses.calls:
+        assert "alternatives=false" in call.request.url
+
+
+@responses.activate
+def test_cli_directions_chunked_geojson():
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main_group,
+        [
+            "--access-token", "test-token",
+            "directions"
+        ] + ["[{0}, 0]".format(i) for i in range(30)]
+    )
+
+    assert result.exit_code == 0
+    feature, = json.loads(result.output)["features"]
+    assert feature["geometry"]["coordinates"] == [
+        [float(i), 0.0] for i in range(30)]
+    assert feature["properties"] == {"distance": 290.0, "duration": 29.0}
+
+
+@responses.activate
+def test_cli_directions_compact_geometry():
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main_group,
+        [
+            "--access-token", "test-token",
+            "directions",
+            "--compact-geometry",
+            "[-77.123456, 38.5]", "[-77.5, 38.654321]"
+        ]
+    )
+
+    assert result.exit_code == 0
+    assert "geometries=polyline6" in responses.calls[0].request.url
+    feature, = json.loads(result.output)["features"]
+    assert feature["geometry"] == {
+        "type": "LineString",
+        "coordinates": [[-77.123456, 38.5], [-77.5, 38.654321]]}
+
+
+@responses.activate
+def test_cli_directions_cache(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+    args = ["--access-token", "test-token", "directions", "--cache",
+            "--cache-dir", str(tmpdir)]
+
+    result = runner.invoke(
+        main_group, args + ["[-77.123456, 38.5]", "[-77.5, 38.654321]"])
+    assert result.exit_code == 0
+    assert "Cache: 0 hits, 1 misses" in result.output
+    first = result.output.splitlines()[0]
+
+    # Waypoints equal at 5 decimal places share a cached route.
+    result = runner.invoke(
+        main_group, args + ["[-77.1234561, 38.5]", "[-77.5, 38.6543209]"])
+    assert result.exit_code == 0
+    assert "Cache: 1 hits, 0 misses" in result.output
+    assert result.output.splitlines()[0] == first
+    assert len(responses.calls) == 1
+
+    # As do the routes of a batch.
+    result = runner.invoke(
+        main_group, args + ["--batch", "-"],
+        input="[[-77.123456, 38.5], [-77.5, 38.654321]]\n")
+    assert result.exit_code == 0
+    assert "Cache: 1 hits, 0 misses" in result.output
+    assert len(responses.calls) == 1
+
+    # Other options or a finer precision miss.
+    result = runner.invoke(
+        main_group, args + ["--profile", "mapbox/walking",
+                            "[-77.123456, 38.5]", "[-77.5, 38.654321]"])
+    assert "Cache: 0 hits, 1 misses" in result.output
+    result = runner.invoke(
+        main_group, args + ["--cache-precision", "6",
+                            "[-77.1234561, 38.5]", "[-77.5, 38.6543209]"])
+    assert "Cache: 0 hits, 1 misses" in result.output
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_cli_directions_features():
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+    args = ["--access-token", "test-token", "directions",
+            "--geometries", "polyline6"]
+    waypoints = ["[0, 0]", "[1, 0]", "[2, 0]"]
+
+    result = runner.invoke(main_group, args + ["--features", "route"] +
+                           waypoints)
+    assert result.exit_code == 0
+    route, = [json.loads(line) for line in result.output.splitlines()]
+    assert route["type"] == "Feature"
+    assert route["geometry"]["coordinates"] == [[0, 0], [1, 0], [2, 0]]
+    assert route["properties"] == {
+        "route": 0, "distance": 20.0, "duration": 2.0}
+
+    result = runner.invoke(main_group, args + ["--features", "leg"] +
+                           waypoints)
+    assert result.exit_code == 0
+    legs = [json.loads(line) for line in result.output.splitlines()]
+    assert [f["properties"]["leg"] for f in legs] == [0, 1]
+    assert legs[0]["geometry"] is None
+
+    result = runner.invoke(
+        main_group, args + ["--features", "route", "--batch", "-"],
+        input="[[0, 0], [1, 0]]\n[[0, 0], [2, 0]]\n")
+    assert result.exit_code == 0
+    features = [json.loads(line) for line in result.output.splitlines()]
+    assert [f["properties"]["index"] for f in features] == [0, 1]
+
+
+def annotated_route_callback(request):
+    """Respond with a straight route with annotations of its legs."""
+    status, headers, body = route_callback(request)
+    data = json.loads(body)
+    for i, leg in enumerate(data["routes"][0]["legs"]):
+        leg["annotation"] = {"duration": [1.0], "speed": [10.0 * i]}
+    return (status, headers, json.dumps(data))
+
+
+@responses.activate
+def test_cli_directions_segments(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=annotated_route_callback
+    )
+
+    runner = CliRunner()
+    args = ["--access-token", "test-token", "directions",
+            "--annotations", "duration,speed", "--segments", "csv"]
+
+    result = runner.invoke(
+        main_group, args + ["[0, 0]", "[1, 0]", "[2, 0]"])
+    assert result.exit_code == 0
+    assert "overview=full" in responses.calls[0].request.url
+    assert result.output.splitlines() == [
+        "route,leg,segment,start_lng,start_lat,end_lng,end_lat,duration,"
+        "speed",
+        "0,0,0,0.0,0.0,1.0,0.0,1.0,0.0",
+        "0,1,0,1.0,0.0,2.0,0.0,1.0,10.0"]
+
+    result = runner.invoke(
+        main_group, args + ["--batch", "-"],
+        input="[[0, 0], [1, 0]]\nlolwut\n[[0, 0], [2, 0]]\n")
+    assert result.exit_code == 0
+    assert '{"index": 1, "error": ' in result.output
+    assert "Errors: 1 routes failed" in result.output
+    lines = [line for line in result.output.splitlines()
+             if line[0].isalnum() and not line.startswith("Errors")]
+    assert lines[0].startswith("index,route,leg,segment,")
+    assert [line.split(",")[0] for line in lines[1:]] == ["0", "2"]
+
+    # The columns are those of the annotations requested, whether or
+    # not the routes have them.
+    result = runner.invoke(
+        main_group,
+        ["--access-token", "test-token", "directions",
+         "--annotations", "speed,distance", "--segments", "csv",
+         "[0, 0]", "[1, 0]"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "route,leg,segment,start_lng,start_lat,end_lng,end_lat,speed,"
+        "distance",
+        "0,0,0,0.0,0.0,1.0,0.0,0.0,"]
+
+
+def test_cli_directions_segments_pyarrow_missing():
+    try:
+        import pyarrow
+        pytest.skip("pyarrow is installed")
+    except ImportError:
+        pass
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ["--access-token", "test-token", "directions",
+         "--annotations", "duration", "--segments", "parquet",
+         "[0, 0]", "[1, 0]"])
+    assert result.exit_code == 2
+    assert "pyarrow is not installed" in result.output
+
+
+def test_cli_directions_segments_requires_annotations():
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ["--access-token", "test-token", "directions",
+         "--segments", "csv", "[0, 0]", "[1, 0]"])
+    assert result.exit_code == 2
+    assert "--segments requires --annotations" in result.output
+
+
+@responses.activate
+def test_cli_directions_incremental(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+    args = ["--access-token", "test-token", "directions", "--incremental",
+            "--cache", "--cache-dir", str(tmpdir)]
+
+    result = runner.invoke(
+        main_group, args + ["[0, 0]", "[1, 0]", "[2, 0]", "[3, 0]"])
+    assert result.exit_code == 0
+    assert "Cache: 0 hits, 3 misses" in result.output
+    assert len(responses.calls) == 3
+    assert "alternatives=false" in responses.calls[0].request.url
+    feature, = json.loads(result.output.splitlines()[0])["features"]
+    assert feature["geometry"]["coordinates"] == [
+        [0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [3.0, 0.0]]
+    assert feature["properties"] == {"distance": 30.0, "duration": 3.0}
+
+    # Moving a waypoint re-requests the legs that end at it.
+    result = runner.invoke(
+        main_group, args + ["[0, 0]", "[1, 0]", "[2, 1]", "[3, 0]"])
+    assert result.exit_code == 0
+    assert "Cache: 1 hits, 2 misses" in result.output
+    assert len(responses.calls) == 5
+
+    result = runner.invoke(
+        main_group, ["--access-token", "test-token", "directions",
+                     "--incremental", "[0, 0]", "[1, 0]"])
+    assert result.exit_code == 2
+    assert "--incremental requires --cache" in result.output
+
+
+@responses.activate
+def test_cli_directions_simplify(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=route_callback
+    )
+
+    runner = CliRunner()
+    args = ["--access-token", "test-token", "directions", "--cache",
+            "--cache-dir", str(tmpdir)]
+    waypoints = ["[0.123456, 0]", "[1, 0.00001]", "[2, 0]"]
+
+    result = runner.invoke(
+        main_group, args + ["--simplify", "0.001", "--precision", "3"] +
+        waypoints)
+    assert result.exit_code == 0
+    feature, = json.loads(result.output.splitlines()[0])["features"]
+    assert feature["geometry"]["coordinates"] == [[0.123, 0.0], [2.0, 0.0]]
+
+    # The cached response keeps every position.
+    result = runner.invoke(main_group, args + waypoints)
+    assert "Cache: 1 hits, 0 misses" in result.output
+    feature, = json.loads(result.output.splitlines()[0])["features"]
+    assert len(feature["geometry"]["coordinates"]) == 3
+
+
+@responses.activate
+def test_cli_directions_batch_connection_error():
+    def callback(request):
+        if "2.0,2.0" in unquote(request.url):
+            raise ConnectionError("Connection reset")
+        return route_callback(request)
+
+    responses.add_callback(
+        responses.GET,
+        re.compile("https://api.mapbox.com/directions/v5/mapbox/driving/.*"),
+        callback=callback
+    )
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ["--access-token", "test-token", "directions", "--batch", "-"],
+        input="[[0, 0], [1, 1]]\n[[0, 0], [2, 2]]\n[[0, 0], [3, 3]]\n")
+
+    assert result.exit_code == 0
+    results = [json.loads(line) for line in result.output.splitlines()
+               if line.startswith("{")]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert "Connection reset" in results[1]["error"]
+    assert "features" in results[2]
+    assert "Errors: 1 routes failed" in result.output
@@ -1,11 +1,17 @@
+import io
 import json
+import re
 
 from click.testing import CliRunner
 from mapbox.errors import ValidationError
 from mock import patch
+import pytest
 import responses
+from six.moves.urllib.parse import unquote
 
+from mapboxcli.compat import json_codec
 from mapboxcli.scripts.cli import main_group
+from mapboxcli.scripts.geocoding import csv_line
 
 
 @responses.activate
@@ -213,11 +219,9 @@ def test_cli_geocode_rev_bad_place():
     assert result.exit_code == 2
 
 
-@patch('mapboxcli.scripts.geocoding.Geocoder')
-def test_cli_geocode_validation_error_handling(Geocoder):
+@patch('mapbox.Geocoder.reverse', side_effect=ValidationError("Invalid"))
+def test_cli_geocode_validation_error_handling(reverse):
     """ValidationError errors are handled"""
-    Geocoder.return_value.place_types.return_value = {'country': 'country'}
-    Geocoder.return_value.reverse.side_effect = ValidationError("Invalid")
 
     runner = CliRunner()
     lon, lat = -77.4371, 91.0
@@ -340,3 +344,686 @@ def test_cli_geocode_fwd_features():
         catch_exceptions=False)
     assert result.exit_code == 0
     assert result.output == '{"name": "first"}\n{"name": "second"}\n'
+
+
+
+def echo_query_callback(request):
+    """Respond with the query found in the request URL."""
+    path = request.path_url.split('?')[0]
+    query = unquote(path.split('/')[-1][:-len('.json')]).strip()
+    return (200, {}, json.dumps({"query": [query]}))
+
+
+@responses.activate
+def test_cli_geocode_concurrency():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--concurrency', '3'],
+        input='first\nsecond\nthird',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == (
+        '{"query": ["first"]}\n{"query": ["second"]}\n{"query": ["third"]}\n')
+
+
+@responses.activate
+def test_cli_geocode_unordered():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--concurrency', '3',
+         '--unordered'],
+        input='first\nsecond\nthird',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert sorted(result.output.splitlines()) == [
+        '{"query": ["first"]}', '{"query": ["second"]}', '{"query": ["third"]}']
+
+
+@responses.activate
+def test_cli_geocode_cache(tmpdir):
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    args = ['--access-token', 'bogus', 'geocoding', '--cache',
+            '--cache-dir', str(tmpdir)]
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group, args, input='first\nsecond', catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Cache: 0 hits, 2 misses" in result.output
+    assert len(responses.calls) == 2
+
+    result = runner.invoke(
+        main_group, args, input='First\nthird', catch_exceptions=False)
+    assert result.exit_code == 0
+    assert '{"query": ["first"]}\n{"query": ["third"]}\n' in result.output
+    assert "Cache: 1 hits, 1 misses" in result.output
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_cli_geocode_reverse_precision():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse',
+         '--reverse-precision', '2'],
+        input='-77.4371,37.5227\n-77.4412,37.5189\n-77.5,37.5',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert (
+        '{"query": ["-77.44,37.52"]}\n'
+        '{"query": ["-77.44,37.52"]}\n'
+        '{"query": ["-77.5,37.5"]}\n') in result.output
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_cli_geocode_duplicates():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--concurrency', '2'],
+        input='first\nsecond\nFirst\n  first  \nsecond',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert (
+        '{"query": ["first"]}\n{"query": ["second"]}\n{"query": ["first"]}\n'
+        '{"query": ["first"]}\n{"query": ["second"]}\n') in result.output
+    assert "Duplicate queries: 3 requests saved" in result.output
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_cli_geocode_reverse_duplicates():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse'],
+        input='-77.4371,37.5227\n[-77.4371, 37.5227]\n-77.5,37.5',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "Duplicate queries: 1 requests saved" in result.output
+    assert len(responses.calls) == 2
+
+
+class LineInput(io.RawIOBase):
+    """A binary stdin that yields one line per read and records the
+    number of requests made before each read."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.calls = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not len(b):
+            return 0
+        self.calls.append(len(responses.calls))
+        if not self.lines:
+            return 0
+        line = self.lines.pop(0)
+        b[:len(line)] = line
+        return len(line)
+
+
+@responses.activate
+def test_cli_geocode_reverse_stdin_streams():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    stdin = LineInput([b'-77.4371,37.5227\n', b'-77.5,37.5\n'])
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse'],
+        input=stdin, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert len(responses.calls) == 2
+    # The first query is requested before the second line is read.
+    assert stdin.calls[:3] == [0, 1, 2]
+
+
+def batch_callback(request):
+    """Respond to batch requests with a list of collections."""
+    path = request.path_url.split('?')[0]
+    queries = [unquote(q).strip()
+               for q in path.split('/')[-1][:-len('.json')].split(';')]
+    if len(queries) == 1:
+        return (200, {}, json.dumps({"query": queries}))
+    return (200, {}, json.dumps([{"query": [q]} for q in queries]))
+
+
+@responses.activate
+def test_cli_geocode_batch():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places-permanent/.*'),
+        callback=batch_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '-d',
+         'mapbox.places-permanent', '--batch-size', '3'],
+        input='first\nsecond\nfirst\n1 a;b st\nthird\n',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output.splitlines()[:5] == [
+        '{"query": ["first"]}', '{"query": ["second"]}',
+        '{"query": ["first"]}', '{"query": ["1 a;b st"]}',
+        '{"query": ["third"]}']
+    assert "Duplicate queries: 1 requests saved" in result.output
+    assert len(responses.calls) == 3
+    assert responses.calls[0].request.path_url.startswith(
+        '/geocoding/v5/mapbox.places-permanent/first;second.json')
+
+
+@pytest.mark.parametrize('concurrency', ['1', '2'])
+@responses.activate
+def test_cli_geocode_batch_duplicates_across_chunks(concurrency):
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places-permanent/.*'),
+        callback=batch_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '-d',
+         'mapbox.places-permanent', '--batch-size', '3',
+         '--concurrency', concurrency],
+        input='a\nb\nc\na\nb\nc\n',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert [json.loads(line)['query'][0]
+            for line in result.output.splitlines()[:6]] == list('abcabc')
+    assert "Duplicate queries: 3 requests saved" in result.output
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_cli_geocode_batch_reverse():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places-permanent/.*'),
+        callback=batch_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse', '-d',
+         'mapbox.places-permanent', '--batch-size', '50'],
+        input='-77.4371,37.5227\n-77.5,37.5',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == (
+        '{"query": ["-77.4371,37.5227"]}\n{"query": ["-77.5,37.5"]}\n')
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_cli_geocode_batch_fallback():
+
+    def callback(request):
+        if ';' in request.path_url:
+            return (422, {}, '{"message": "Batch failed"}')
+        return echo_query_callback(request)
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places-permanent/.*'),
+        callback=callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '-d',
+         'mapbox.places-permanent', '--batch-size', '2'],
+        input='first\nsecond',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == '{"query": ["first"]}\n{"query": ["second"]}\n'
+    assert len(responses.calls) == 3
+
+
+def test_cli_geocode_batch_dataset():
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['geocoding', '--batch-size', '2'],
+        input='first\nsecond')
+    assert result.exit_code == 2
+    assert "mapbox.places-permanent" in result.output
+
+
+@responses.activate
+def test_cli_geocode_features_orjson():
+    pytest.importorskip('orjson')
+
+    responses.add(
+        responses.GET,
+        'https://api.mapbox.com/geocoding/v5/mapbox.places/1600%20pennsylvania%20ave%20nw.json?access_token=bogus',
+        match_querystring=True,
+        body='{"features": [{"name": "first"}, {"name": "second"}]}', status=200,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--features',
+         '--json-backend', 'orjson', '1600 pennsylvania ave nw'],
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == '{"name":"first"}\n{"name":"second"}\n'
+
+
+@patch.dict('sys.modules', {'orjson': None})
+def test_cli_geocode_orjson_missing():
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['geocoding', '--json-backend', 'orjson', 'lolwut'])
+    assert result.exit_code == 2
+    assert "orjson is not installed" in result.output
+
+
+def test_cli_geocode_output_file(tmpdir):
+    """Raw response bytes are written to the output file."""
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            responses.GET,
+            'https://api.mapbox.com/geocoding/v5/mapbox.places/lolwut.json?access_token=bogus',
+            match_querystring=True,
+            body=u'{"query": ["lolwut"], "place_name": "Z\u00fcrich"}'.encode('utf-8'),
+            status=200, content_type='application/json')
+        filename = str(tmpdir.join('out.json'))
+        runner = CliRunner()
+        result = runner.invoke(
+            main_group,
+            ['--access-token', 'bogus', 'geocoding', '-o', filename, 'lolwut'],
+            catch_exceptions=False)
+    assert result.exit_code == 0
+    with open(filename, 'rb') as f:
+        assert f.read() == (
+            u'{"query": ["lolwut"], "place_name": "Z\u00fcrich"}\n'.encode('utf-8'))
+
+
+def test_cli_geocode_checkpoint(tmpdir):
+    output = str(tmpdir.join('out.json'))
+    checkpoint = str(tmpdir.join('job.ckpt'))
+    args = ['--access-token', 'bogus', 'geocoding', '-o', output,
+            '--checkpoint', checkpoint, '--checkpoint-interval', '1']
+    queries = 'first\nsecond\nthird\nfourth\n'
+
+    def failing_callback(request):
+        if 'third' in request.path_url:
+            return (500, {}, '{"message": "Oops"}')
+        return echo_query_callback(request)
+
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+            callback=failing_callback,
+            content_type='application/json')
+        result = CliRunner().invoke(main_group, args, input=queries)
+    assert result.exit_code == 1
+    with open(checkpoint) as f:
+        assert json.load(f)['count'] == 2
+
+    # Partial output after the checkpoint is discarded.
+    with open(output, 'ab') as f:
+        f.write(b'{"query": ["thi')
+
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+            callback=echo_query_callback,
+            content_type='application/json')
+        result = CliRunner().invoke(
+            main_group, args, input=queries, catch_exceptions=False)
+        assert len(rsps.calls) == 2
+    assert result.exit_code == 0
+    with open(output) as f:
+        assert f.read() == (
+            '{"query": ["first"]}\n{"query": ["second"]}\n'
+            '{"query": ["third"]}\n{"query": ["fourth"]}\n')
+    assert not tmpdir.join('job.ckpt').exists()
+
+
+def test_cli_geocode_checkpoint_partial_record(tmpdir):
+    """A record interrupted between its lines is written again, once."""
+    output = str(tmpdir.join('out.json'))
+    checkpoint = str(tmpdir.join('job.ckpt'))
+    args = ['--access-token', 'bogus', 'geocoding', '--features',
+            '-o', output, '--checkpoint', checkpoint,
+            '--checkpoint-interval', '1']
+    queries = 'first\nsecond\nthird\n'
+
+    def features_callback(request):
+        query = request.path_url.split('/')[-1].split('.json')[0]
+        return (200, {}, json.dumps({'type': 'FeatureCollection', 'features': [
+            {'id': query + '1'}, {'id': query + '2'}]}))
+
+    def interrupted_codec(name):
+        loads, dumps = json_codec(name)
+
+        def interrupted_dumps(obj):
+            if obj.get('id') == 'second2':
+                raise KeyboardInterrupt()
+            return dumps(obj)
+        return loads, interrupted_dumps
+
+    for codec in (interrupted_codec, json_codec):
+        with patch('mapboxcli.scripts.geocoding.json_codec', codec):
+            with responses.RequestsMock(
+                    assert_all_requests_are_fired=False) as rsps:
+                rsps.add_callback(
+                    responses.GET,
+                    re.compile(
+                        'https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+                    callback=features_callback,
+                    content_type='application/json')
+                result = CliRunner().invoke(main_group, args, input=queries)
+    assert result.exit_code == 0
+    with open(output) as f:
+        assert [json.loads(line)['id'] for line in f] == [
+            'first1', 'first2', 'second1', 'second2', 'third1', 'third2']
+
+
+def test_cli_geocode_checkpoint_mismatch(tmpdir):
+    output = str(tmpdir.join('out.json'))
+    checkpoint = str(tmpdir.join('job.ckpt'))
+    queries = tmpdir.join('queries.txt')
+    queries.write('first\nsecond\n')
+    args = ['--access-token', 'bogus', 'geocoding', '-o', output,
+            '--checkpoint', checkpoint]
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            responses.GET,
+            re.compile('https://api.mapbox.com/geocoding/v5/.*'),
+            status=500, body='{"message": "Oops"}')
+        result = CliRunner().invoke(main_group, args + [str(queries)])
+    assert result.exit_code == 1
+    assert tmpdir.join('job.ckpt').exists()
+
+    other = tmpdir.join('other.txt')
+    other.write('third\n')
+    for extra in ([str(other)], ['--limit', '1', str(queries)]):
+        result = CliRunner().invoke(main_group, args + extra)
+        assert result.exit_code == 2
+        assert "different input, output or options" in result.output
+
+
+def test_cli_geocode_checkpoint_stdout():
+    result = CliRunner().invoke(
+        main_group, ['geocoding', '--checkpoint', 'job.ckpt', 'lolwut'])
+    assert result.exit_code == 2
+    assert "output file" in result.output
+
+
+def place_callback(request):
+    """Respond with a feature named after the query."""
+    path = request.path_url.split('?')[0]
+    query = unquote(path.split('/')[-1][:-len('.json')])
+    return (200, {}, json.dumps({"features": [{
+        "id": "place.1", "place_name": query.upper(), "relevance": 0.99,
+        "center": [-77.5, 37.5]}]}))
+
+
+@responses.activate
+def test_cli_geocode_csv():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=place_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--input-format', 'csv',
+         '--address-column', 'street', '--address-column', 'city'],
+        input='id,street,city\n1,1 Main St,"Richmond, VA"\n2,,\n3,,Paris\n',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == (
+        'id,street,city,result_lon,result_lat,result_place_name,'
+        'result_relevance\n'
+        '1,1 Main St,"Richmond, VA",-77.5,37.5,"1 MAIN ST, RICHMOND, VA",0.99\n'
+        '2,,,,,,\n'
+        '3,,Paris,-77.5,37.5,PARIS,0.99\n')
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_cli_geocode_csv_reverse():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=place_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse',
+         '--input-format', 'csv', '--lon-column', 'x', '--lat-column', 'y',
+         '--result-fields', 'id,place_name', '--concurrency', '2'],
+        input='x,y\n-77.4371,37.5227\n-77.5,37.5\n',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == (
+        'x,y,result_id,result_place_name\n'
+        '-77.4371,37.5227,place.1,"-77.4371,37.5227"\n'
+        '-77.5,37.5,place.1,"-77.5,37.5"\n')
+
+
+def test_cli_geocode_csv_missing_column():
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['geocoding', '--input-format', 'csv'],
+        input='street,city\n1 Main St,Richmond\n')
+    assert result.exit_code == 2
+    assert "No column named address" in result.output
+
+
+@responses.activate
+def test_cli_geocode_csv_bad_coords(caplog):
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=place_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse',
+         '--input-format', 'csv', '--result-fields', 'lon'],
+        input='lon,lat\nlol,wut\n-77.5,37.5\n',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[:2] == ['lon,lat,result_lon', 'lol,wut,']
+    assert lines[2].startswith('-77.5,37.5,')
+    assert len(responses.calls) == 1
+    assert "Invalid coordinates on line 2" in caplog.text
+
+
+def test_csv_line():
+    assert csv_line([u'caf\xe9', 1, '']) == u'caf\xe9,1,\n'.encode('utf-8')
+
+
+@responses.activate
+def test_cli_geocode_geojson():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=place_callback,
+        content_type='application/json')
+
+    collection = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"id": 1},
+         "geometry": {"type": "Point", "coordinates": [-77.4371, 37.5227]}},
+        {"type": "Feature", "properties": {"id": 2},
+         "geometry": {"type": "LineString",
+                      "coordinates": [[0, 0], [1, 1]]}},
+        {"type": "Feature", "properties": None,
+         "geometry": {"type": "Point", "coordinates": [-77.5, 37.5]}}]}
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse',
+         '--input-format', 'geojson', '--result-fields', 'place_name,text',
+         '--concurrency', '2'],
+        input=json.dumps(collection),
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    features = [json.loads(line) for line in result.output.splitlines()]
+    assert [f['properties'] for f in features] == [
+        {"id": 1, "result_place_name": "-77.4371,37.5227",
+         "result_text": None},
+        {"id": 2},
+        {"result_place_name": "-77.5,37.5", "result_text": None}]
+    assert features[1]['geometry']['type'] == 'LineString'
+    assert len(responses.calls) == 2
+
+
+def test_cli_geocode_geojson_forward():
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group, ['geocoding', '--input-format', 'geojson'], input='{}')
+    assert result.exit_code == 2
+    assert "requires --reverse" in result.output
+
+
+@responses.activate
+def test_cli_geocode_reverse_invalid():
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=echo_query_callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--reverse'],
+        input='-77.4371,37.5227\nlolwut\n')
+    assert result.exit_code == 2
+    assert "query 2" in result.output
+    # The valid query before the invalid one is still requested.
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_cli_geocode_rate_limited():
+    """Rate limited requests are retried."""
+    statuses = [429, 429]
+
+    def callback(request):
+        if statuses:
+            return (statuses.pop(), {'Retry-After': '0'}, 'Too Many Requests')
+        return echo_query_callback(request)
+
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        callback=callback,
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--concurrency', '2'],
+        input='first\nsecond',
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    assert '{"query": ["first"]}\n{"query": ["second"]}\n' in result.output
+    assert "Rate limited: 2 responses, concurrency" in result.output
+    assert len(responses.calls) == 4
+
+
+@responses.activate
+def test_cli_geocode_rate_limited_retries():
+
+    responses.add(
+        responses.GET,
+        re.compile('https://api.mapbox.com/geocoding/v5/mapbox.places/.*'),
+        status=429, headers={'Retry-After': '0'},
+        body='{"message":"Too Many Requests"}',
+        content_type='application/json')
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'geocoding', '--max-retries', '1'],
+        input='first')
+    assert result.exit_code == 1
+    assert "Too Many Requests" in result.output
+    assert len(responses.calls) == 2
@@ -0,0 +1,74 @@
+import polyline
+import pytest
+
+from mapboxcli import geometry
+from mapboxcli.geometry import (
+    decode_polyline, encode_polyline, round_coordinates, simplify)
+
+
+COORDS = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+
+
+def test_decode_polyline():
+    assert decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@') == COORDS
+
+
+def test_decode_polyline6():
+    encoded = polyline.encode([(lat, lng) for lng, lat in COORDS], 6)
+    assert decode_polyline(encoded, 6) == COORDS
+
+
+def test_decode_empty():
+    assert decode_polyline('') == []
+
+
+def test_encode_polyline():
+    assert encode_polyline(COORDS) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_roundtrip(precision):
+    coords = [[i * 0.001 - 77.0, 38.9 + (-1) ** i * i * 0.0001]
+              for i in range(500)]
+    encoded = encode_polyline(coords, precision)
+    assert encoded == polyline.encode(
+        [(lat, lng) for lng, lat in coords], precision)
+    assert decode_polyline(encoded, precision) == [
+        [round(lng, precision), round(lat, precision)]
+        for lng, lat in coords]
+
+
+def test_decode_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    coords = [[i * 0.001 - 77.0, 38.9] for i in range(500)]
+    encoded = encode_polyline(coords, 6)
+    decoded = decode_polyline(encoded, 6)
+    monkeypatch.setattr(geometry, 'numpy', None)
+    assert decoded == decode_polyline(encoded, 6)
+
+
+def test_simplify():
+    line = [[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 6], [5, 7.01], [6, 8]]
+    assert simplify(line, 0.5) == [[0, 0], [2, -0.1], [3, 5], [6, 8]]
+    assert simplify(line, 10) == [[0, 0], [6, 8]]
+    assert simplify(line, 0) == line
+    assert simplify(line[:2], 1) == line[:2]
+
+
+def test_simplify_closed():
+    ring = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    assert simplify(ring, 0.1) == ring
+
+
+def test_simplify_numpy(monkeypatch):
+    pytest.importorskip('numpy')
+    line = [[i * 0.001, 0.0005 * (i % 7) + (i // 50) * 0.01]
+            for i in range(1000)]
+    simplified = simplify(line, 0.002)
+    assert 2 < len(simplified) < len(line)
+    monkeypatch.setattr(geometry, 'numpy', None)
+    assert simplified == simplify(line, 0.002)
+
+
+def test_round_coordinates():
+    assert round_coordinates([[1.23456, -1.23456]], 2) == [[1.23, -1.23]]
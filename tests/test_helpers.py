@@ -1,15 +1,40 @@
-from mapboxcli.scripts.geocoding import coords_from_query, iter_query
+import click
+import pytest
+
+from mapboxcli.scripts.geocoding import (
+    coords_from_query, iter_coords, iter_query, parse_coords, result_values,
+    snap_coords)
 
 
 def test_iter_query_string():
-    assert iter_query("lolwut") == ["lolwut"]
+    assert list(iter_query("lolwut")) == ["lolwut"]
 
 
 def test_iter_query_file(tmpdir):
     filename = str(tmpdir.join('test.txt'))
     with open(filename, 'w') as f:
         f.write("lolwut")
-    assert iter_query(filename) == ["lolwut"]
+    assert list(iter_query(filename)) == ["lolwut"]
+
+
+def test_iter_query_file_lines(tmpdir):
+    """Lines are stripped and blank lines skipped."""
+    filename = str(tmpdir.join('test.txt'))
+    with open(filename, 'w') as f:
+        f.write("lol\n\n  \nwut  \r\n")
+    assert list(iter_query(filename)) == ["lol", "wut"]
+
+
+def test_iter_query_lazy(tmpdir):
+    """Lines are yielded before the whole file is read."""
+    filename = str(tmpdir.join('test.txt'))
+    with open(filename, 'w') as f:
+        f.write("lol\nwut\n")
+    queries = iter_query(filename)
+    assert next(queries) == "lol"
+    with open(filename, 'a') as f:
+        f.write("more\n")
+    assert list(queries) == ["wut", "more"]
 
 
 def test_coords_from_query_json():
@@ -28,3 +53,52 @@ def test_coords_from_query_csv_no_ws():
 
 def test_coords_from_query_ws():
     assert coords_from_query("-100 40") == (-100, 40)
+
+
+def test_snap_coords():
+    assert snap_coords((-77.43712, 37.52268), 3) == (-77.437, 37.523)
+
+
+def test_result_values():
+    collection = {"features": [
+        {"center": [-77.5, 37.5], "place_name": "Richmond",
+         "place_type": ["place", "region"]},
+        {"center": [0, 0], "place_name": "Null Island"}]}
+    assert result_values(
+        collection, ['lon', 'lat', 'place_name', 'place_type', 'lolwut']) == [
+            -77.5, 37.5, "Richmond", "place,region", '']
+
+
+def test_result_values_empty():
+    assert result_values({"features": []}, ['lon', 'place_name']) == ['', '']
+
+
+def test_parse_coords():
+    coords, errors = parse_coords(
+        ["-100, 40", "-100 40", "[-100, 40]", "-100,40"])
+    assert list(coords) == [-100.0, 40.0] * 4
+    assert errors == []
+
+
+def test_parse_coords_errors():
+    coords, errors = parse_coords(["-100, 40", "lolwut", "1, x", "2, 3"])
+    assert list(coords) == [-100.0, 40.0, 2.0, 3.0]
+    assert errors == [1, 2]
+
+
+def test_iter_coords():
+    lines = ["-100, {0}".format(i) for i in range(5)]
+    assert list(iter_coords(lines, block_size=2)) == [
+        coords_from_query(line) for line in lines]
+
+
+def test_iter_coords_error():
+    lines = ["-100, 40", "-100, 41", "-100, 42", "lolwut"]
+    coords = iter_coords(lines, block_size=2)
+    # The valid queries of a block are yielded before the error.
+    assert next(coords) == (-100, 40)
+    assert next(coords) == (-100, 41)
+    assert next(coords) == (-100, 42)
+    with pytest.raises(click.BadParameter) as excinfo:
+        next(coords)
+    assert "query 4" in str(excinfo.value)
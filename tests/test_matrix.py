@@ -0,0 +1,126 @@
+import json
+import re
+import struct
+
+from click.testing import CliRunner
+import pytest
+import responses
+from six.moves.urllib.parse import parse_qs, unquote, urlsplit
+
+from mapboxcli.scripts.cli import main_group
+from mapboxcli.scripts.matrix import matrix_tiles, tile_shape
+
+
+def points(count, lat=0):
+    return '\n'.join(json.dumps({
+        "type": "Feature", "properties": {},
+        "geometry": {"type": "Point", "coordinates": [i, lat]}})
+        for i in range(count))
+
+
+def matrix_callback(request):
+    """Respond with durations of 1000 * origin longitude + destination
+    longitude and distances of their sum."""
+    url = urlsplit(request.url)
+    query = parse_qs(url.query)
+    path = unquote(url.path.split('/')[-1])
+    coords = [float(pair.split(',')[0]) for pair in path.split(';')]
+    assert len(coords) <= 25
+    sources = [coords[int(i)] for i in query['sources'][0].split(';')]
+    destinations = [
+        coords[int(i)] for i in query['destinations'][0].split(';')]
+    body = {
+        "code": "Ok",
+        "durations": [[1000 * s + d for d in destinations] for s in sources],
+        "distances": [[s + d for d in destinations] for s in sources]}
+    return (200, {}, json.dumps(body))
+
+
+@pytest.mark.parametrize("sources,destinations,limit", [
+    (1, 1, 25), (3, 100, 25), (100, 3, 25), (100, 100, 25), (30, 30, 10)])
+def test_matrix_tiles(sources, destinations, limit):
+    rows, cols = tile_shape(sources, destinations, limit)
+    assert rows + cols <= limit
+    cells = set()
+    for row, col, height, width in matrix_tiles(sources, destinations, limit):
+        assert height + width <= limit
+        cells.update((row + i, col + j)
+                     for i in range(height) for j in range(width))
+    assert len(cells) == sources * destinations
+
+
+@responses.activate
+def test_cli_matrix(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/directions-matrix/v1/.*'),
+        callback=matrix_callback)
+
+    origins = str(tmpdir.join('origins.geojson'))
+    destinations = str(tmpdir.join('destinations.geojson'))
+    with open(origins, 'w') as f:
+        f.write(points(30))
+    with open(destinations, 'w') as f:
+        f.write(points(20, lat=1))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'matrix', '--origins', origins,
+         '--destinations', destinations, '--concurrency', '4'],
+        catch_exceptions=False)
+    assert result.exit_code == 0
+    data = json.loads(result.output)
+    assert data['durations'] == [
+        [1000.0 * i + j for j in range(20)] for i in range(30)]
+    assert data['distances'] == [
+        [float(i + j) for j in range(20)] for i in range(30)]
+    assert len(responses.calls) == 6
+
+
+@responses.activate
+def test_cli_matrix_npy(tmpdir):
+    responses.add_callback(
+        responses.GET,
+        re.compile('https://api.mapbox.com/directions-matrix/v1/.*'),
+        callback=matrix_callback)
+
+    origins = str(tmpdir.join('origins.geojson'))
+    with open(origins, 'w') as f:
+        f.write(points(3))
+    output = str(tmpdir.join('matrix.npy'))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'matrix', '--origins', origins,
+         '--annotations', 'duration', '--format', 'npy', '-o', output],
+        catch_exceptions=False)
+    assert result.exit_code == 0
+
+    with open(output, 'rb') as f:
+        content = f.read()
+    assert content[:8] == b'\x93NUMPY\x01\x00'
+    header_len, = struct.unpack('<H', content[8:10])
+    assert (10 + header_len) % 64 == 0
+    header = content[10:10 + header_len].decode('latin-1')
+    assert "'shape': (3, 3)" in header
+    values = struct.unpack('<9d', content[10 + header_len:])
+    assert values == tuple(
+        1000.0 * i + j for i in range(3) for j in range(3))
+
+
+@responses.activate
+def test_cli_matrix_error():
+    responses.add(
+        responses.GET,
+        re.compile('https://api.mapbox.com/directions-matrix/v1/.*'),
+        body='{"message": "Not Authorized"}', status=401)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main_group,
+        ['--access-token', 'bogus', 'matrix', '--origins', '[0, 0]',
+         '--destinations', '[1, 1]'])
+    assert result.exit_code == 1
+    assert "Not Authorized" in result.output
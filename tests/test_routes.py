@@ -0,0 +1,138 @@
+import polyline
+
+from mapboxcli.routes import (
+    iter_features, iter_segments, join_coordinates, segment_fields,
+    simplify_geometries, split_waypoints, stitch_geometries, stitch_routes)
+
+
+def test_split_waypoints():
+    assert split_waypoints(2) == [(0, 2)]
+    assert split_waypoints(25) == [(0, 25)]
+    assert split_waypoints(26) == [(0, 25), (24, 26)]
+    assert split_waypoints(100) == [(0, 25), (24, 49), (48, 73), (72, 97),
+                                    (96, 100)]
+
+
+def test_split_waypoints_legs():
+    """Segments cover every leg of the route once."""
+    for count in range(2, 80):
+        legs = []
+        for start, stop in split_waypoints(count, 5):
+            assert 2 <= stop - start <= 5
+            legs.extend(range(start, stop - 1))
+        assert legs == list(range(count - 1))
+
+
+def test_join_coordinates():
+    assert join_coordinates([[[0, 0], [1, 1]], [[1, 1], [2, 2]]]) == [
+        [0, 0], [1, 1], [2, 2]]
+    assert join_coordinates([[[0, 0], [1, 1]], [[1.5, 1], [2, 2]]]) == [
+        [0, 0], [1, 1], [1.5, 1], [2, 2]]
+
+
+def test_stitch_polyline():
+    first = polyline.encode([(0, 0), (1, 1)], 6)
+    second = polyline.encode([(1, 1), (2, 2)], 6)
+    assert polyline.decode(
+        stitch_geometries([first, second], 'polyline6'), 6) == [
+            (0, 0), (1, 1), (2, 2)]
+
+
+def test_stitch_routes():
+    def response(start, stop):
+        return {
+            'code': 'Ok',
+            'routes': [{
+                'distance': 10.0 * (stop - start),
+                'duration': 1.0 * (stop - start),
+                'weight_name': 'routability',
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': [[i, 0] for i in range(start, stop + 1)]},
+                'legs': [{'summary': str(i)} for i in range(start, stop)]}],
+            'waypoints': [{'location': [i, 0]}
+                          for i in range(start, stop + 1)]}
+
+    data = stitch_routes([response(0, 2), response(2, 3)])
+    route, = data['routes']
+    assert data['code'] == 'Ok'
+    assert route['distance'] == 30.0
+    assert route['duration'] == 3.0
+    assert route['weight_name'] == 'routability'
+    assert [leg['summary'] for leg in route['legs']] == ['0', '1', '2']
+    assert route['geometry']['coordinates'] == [[i, 0] for i in range(4)]
+    assert [w['location'] for w in data['waypoints']] == [
+        [i, 0] for i in range(4)]
+
+
+def test_iter_features():
+    line = {'type': 'LineString', 'coordinates': [[0, 0], [1, 0]]}
+    data = {'routes': [{
+        'distance': 2.0, 'geometry': line,
+        'legs': [
+            {'distance': 1.0, 'steps': [
+                {'distance': 1.0, 'name': 'a', 'geometry': {
+                    'type': 'LineString', 'coordinates': [[0, 0], [1, 0]]}},
+                {'distance': 0.0, 'name': 'b', 'geometry': {
+                    'type': 'LineString', 'coordinates': [[1, 0], [1, 0]]}}]},
+            {'distance': 1.0, 'steps': []}]}]}
+
+    route, = iter_features(data, 'route')
+    assert route['geometry'] == line
+    assert route['properties'] == {'distance': 2.0, 'route': 0}
+
+    legs = list(iter_features(data, 'leg'))
+    assert [f['properties'] for f in legs] == [
+        {'distance': 1.0, 'route': 0, 'leg': 0},
+        {'distance': 1.0, 'route': 0, 'leg': 1}]
+    assert legs[0]['geometry']['coordinates'] == [[0, 0], [1, 0], [1, 0]]
+    assert legs[1]['geometry'] is None
+
+    steps = list(iter_features(data, 'step'))
+    assert [f['properties']['name'] for f in steps] == ['a', 'b']
+    assert steps[1]['properties'] == {
+        'distance': 0.0, 'name': 'b', 'route': 0, 'leg': 0, 'step': 1}
+
+
+def test_iter_segments():
+    data = {'routes': [{
+        'geometry': {
+            'type': 'LineString',
+            'coordinates': [[0, 0], [1, 0], [2, 0], [3, 0]]},
+        'legs': [
+            {'annotation': {'distance': [1.0, 2.0], 'speed': [3.0, 4.0]}},
+            {'annotation': {'distance': [5.0]}}]}]}
+
+    rows = list(iter_segments(data))
+    assert [(r['leg'], r['segment']) for r in rows] == [(0, 0), (0, 1), (1, 0)]
+    assert rows[1] == {
+        'route': 0, 'leg': 0, 'segment': 1, 'distance': 2.0, 'speed': 4.0,
+        'start_lng': 1, 'start_lat': 0, 'end_lng': 2, 'end_lat': 0}
+    assert rows[2]['start_lng'] == 2 and 'speed' not in rows[2]
+
+    # Without a coordinate for each segment, there are no coordinates.
+    data['routes'][0]['geometry']['coordinates'].pop()
+    assert 'start_lng' not in next(iter_segments(data))
+
+
+def test_segment_fields():
+    assert segment_fields(['speed', 'duration'], index=True) == [
+        'index', 'route', 'leg', 'segment', 'start_lng', 'start_lat',
+        'end_lng', 'end_lat', 'speed', 'duration']
+
+
+def test_simplify_geometries():
+    coords = [[0.0, 0.0], [1.0, 0.00001], [2.0, 0.0]]
+    data = {'routes': [{
+        'geometry': polyline.encode([(lat, lng) for lng, lat in coords]),
+        'legs': [{'steps': [{'geometry': polyline.encode(
+            [(lat, lng) for lng, lat in coords])}]}]}]}
+    simplify_geometries(data, 'polyline', tolerance=0.001)
+    route = data['routes'][0]
+    assert polyline.decode(route['geometry']) == [(0, 0), (0, 2)]
+    assert route['legs'][0]['steps'][0]['geometry'] == route['geometry']
+
+    data = {'routes': [{'geometry': {
+        'type': 'LineString', 'coordinates': [[0.123456, 1.0]]}}]}
+    simplify_geometries(data, 'geojson', precision=2)
+    assert data['routes'][0]['geometry']['coordinates'] == [[0.12, 1.0]]
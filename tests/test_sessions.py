@@ -0,0 +1,64 @@
+import click
+import mapbox
+
+from mapboxcli.batch import AdaptiveLimit, ThrottledAdapter
+from mapboxcli.sessions import SessionFactory
+
+
+def test_services_share_session():
+    sessions = SessionFactory('pk.test')
+    geocoder = sessions.service(mapbox.Geocoder, name='mapbox.places')
+    uploader = sessions.service(mapbox.Uploader)
+    assert geocoder.session is uploader.session is sessions.session
+    assert geocoder.name == 'mapbox.places'
+    assert sessions.session.params['access_token'] == 'pk.test'
+    assert 'gzip' in sessions.session.headers['Accept-Encoding']
+    assert sessions.session.headers['User-Agent'].startswith('mapbox-sdk-py')
+
+
+def test_configure():
+    sessions = SessionFactory('pk.test')
+    session = sessions.session
+    assert session.get_adapter('https://api.mapbox.com')._pool_maxsize == 1
+
+    limit = AdaptiveLimit(8)
+    sessions.configure(pool_size=8, limit=limit)
+    adapter = session.get_adapter('https://api.mapbox.com')
+    assert isinstance(adapter, ThrottledAdapter)
+    assert adapter.limit is limit
+    assert adapter._pool_maxsize == 8
+
+
+def test_service_makes_no_session(monkeypatch):
+    calls = []
+    session = mapbox.services.base.Session
+
+    def spy(*args, **kwargs):
+        calls.append(args)
+        return session(*args, **kwargs)
+
+    monkeypatch.setattr(mapbox.services.base, 'Session', spy)
+    sessions = SessionFactory('pk.test')
+    sessions.service(mapbox.Directions)
+    sessions.service(mapbox.Geocoder, name='mapbox.places')
+    assert len(calls) == 1
+
+
+def test_service_host(monkeypatch):
+    sessions = SessionFactory('pk.test')
+    assert sessions.service(mapbox.Directions).baseuri == (
+        mapbox.Directions(access_token='pk.test').baseuri)
+    monkeypatch.setenv('MAPBOX_HOST', 'example.com')
+    assert sessions.service(mapbox.Directions).host == 'example.com'
+
+
+def test_from_context():
+    sessions = SessionFactory('pk.test')
+    assert SessionFactory.from_context(
+        click.Context(click.Command('test'), obj={'sessions': sessions})
+    ) is sessions
+    made = SessionFactory.from_context(
+        click.Context(click.Command('test'), obj={'access_token': 'pk.a'}))
+    assert made.access_token == 'pk.a'
+    assert SessionFactory.from_context(
+        click.Context(click.Command('test'))).access_token is None
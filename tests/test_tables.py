@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from mapboxcli import tables
+
+
+ROWS = [{'a': 1, 'b': None}, {'a': 2, 'c': {'speed': 50}}]
+
+
+def test_write_csv():
+    f = io.StringIO()
+    writer = tables.TableWriter(f, ['a', 'b', 'c'])
+    assert f.getvalue() == 'a,b,c\n'
+    writer.write_rows(ROWS[:1])
+    writer.write_rows([])
+    writer.write_rows(ROWS[1:])
+    writer.close()
+    assert f.getvalue() == 'a,b,c\n1,,\n2,,"{""speed"": 50}"\n'
+
+
+def test_write_arrow():
+    pyarrow = pytest.importorskip('pyarrow')
+    f = io.BytesIO()
+    writer = tables.TableWriter(
+        f, ['a', 'b', 'c'], 'arrow', types={'a': 'int', 'b': 'float'})
+    for row in ROWS:
+        writer.write_rows([row])
+    writer.close()
+    reader = pyarrow.ipc.open_file(pyarrow.BufferReader(f.getvalue()))
+    assert reader.num_record_batches == 2
+    table = reader.read_all()
+    assert table.column_names == ['a', 'b', 'c']
+    assert table.schema.field('b').type == pyarrow.float64()
+    assert table.to_pydict() == {
+        'a': [1, 2], 'b': [None, None], 'c': [None, '{"speed": 50}']}
+
+
+def test_write_parquet():
+    pytest.importorskip('pyarrow')
+    parquet = pytest.importorskip('pyarrow.parquet')
+    f = io.BytesIO()
+    writer = tables.TableWriter(
+        f, ['a', 'b'], 'parquet', types={'a': 'int'})
+    for row in ROWS:
+        writer.write_rows([row])
+    writer.close()
+    data = parquet.ParquetFile(io.BytesIO(f.getvalue()))
+    assert data.num_row_groups == 2
+    assert data.read().to_pydict() == {'a': [1, 2], 'b': [None, None]}
+
+
+def test_check_format():
+    tables.check_format('csv')
+    try:
+        import pyarrow
+    except ImportError:
+        with pytest.raises(ImportError):
+            tables.check_format('parquet')